@@ -31,7 +31,7 @@ from src.llm_client import load_llm, ask_next_action, reset_fara_history
 from src.vision import capture_screen, capture_screen_raw, draw_preview, screen_changed
 from src.guards import validate_xy, check_repeat, NUDGE, STOP
 from src.actions import execute_action
-from src.design_system import build_stylesheet
+from src.design_system import build_palette, build_stylesheet
 from src.panels import TopBar, CommandPanel, InspectorPanel, LogPanel
 
 log = get_logger("agent")
@@ -635,6 +635,7 @@ class MissionControlWindow(QMainWindow):
             cfg.MODEL_NAME = model_name
             cfg.GGUF_REPO_ID = profile["repo_id"]
             cfg.GGUF_MODEL_FILENAME = profile["model_file"]
+            cfg.GGUF_MODEL_FILENAME_QUANT = profile.get("model_file_quant", "")
             cfg.GGUF_MMPROJ_FILENAME = profile["mmproj_file"]
             cfg.CHAT_HANDLER = profile["chat_handler"]
             cfg.N_CTX = profile.get("n_ctx", 2048)
@@ -683,6 +684,7 @@ def _load_llm_with_retry(max_attempts: int = 3) -> Optional[Any]:
 def main():
     app = QApplication(sys.argv)
     app.setStyle("Fusion")
+    app.setPalette(build_palette())
     w = MissionControlWindow()
     w.showMaximized()
     sys.exit(app.exec())
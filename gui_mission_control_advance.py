@@ -27,7 +27,7 @@ from src.llm_client import load_llm, ask_next_action
 from src.vision import capture_screen, capture_screen_raw, draw_preview
 from src.guards import validate_xy, should_stop_on_repeat
 from src.actions import execute_action
-from src.design_system import build_stylesheet
+from src.design_system import build_palette, build_stylesheet
 from src.panels import TopBar, CommandPanel, InspectorPanel, LogPanel
 from src.planner import PlannerConfig, create_planner, generate_plan, parse_plan_step
 from src.agent_runner_v2 import run_planned_command
@@ -881,6 +881,7 @@ class MissionControlWindowV2(QMainWindow):
 def main():
     app = QApplication(sys.argv)
     app.setStyle("Fusion")
+    app.setPalette(build_palette())
     w = MissionControlWindowV2()
     w.showMaximized()
     sys.exit(app.exec())
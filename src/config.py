@@ -2,7 +2,7 @@ import os
 import re
 import sys
 from dataclasses import dataclass, field
-from typing import Dict, Tuple
+from typing import Dict, Optional, Tuple
 
 # ---------------------------------------------------------------------------
 # Model profiles — add new GGUF models here
@@ -35,6 +35,7 @@ MODEL_PROFILES: Dict[str, Dict] = {
     "fara-7b": {
         "repo_id": "bartowski/microsoft_Fara-7B-GGUF",
         "model_file": "microsoft_Fara-7B-Q8_0.gguf",
+        "model_file_quant": "microsoft_Fara-7B-Q4_K_M.gguf",
         "mmproj_file": "mmproj-microsoft_Fara-7B-f16.gguf",
         "chat_handler": "fara",
         "n_ctx": 16384,
@@ -66,7 +67,9 @@ def _active_profile() -> Dict[str, str]:
     return MODEL_PROFILES[DEFAULT_MODEL]
 
 
-@dataclass
+# slots=True: no per-instance __dict__, attribute reads are slot lookups.
+# Not frozen — model switching (main.py, Mission Control) rewrites fields at runtime.
+@dataclass(slots=True)
 class CFG:
     # ----------------------
     # LLM Model config
@@ -74,6 +77,9 @@ class CFG:
     MODEL_NAME: str = DEFAULT_MODEL
     GGUF_REPO_ID: str = _active_profile()["repo_id"]
     GGUF_MODEL_FILENAME: str = _active_profile()["model_file"]
+    # Lower-bit weights from the same repo, tried first (decode is memory-bound);
+    # empty = always use GGUF_MODEL_FILENAME
+    GGUF_MODEL_FILENAME_QUANT: str = _active_profile().get("model_file_quant", "")
     GGUF_MMPROJ_FILENAME: str = _active_profile()["mmproj_file"]
     CHAT_HANDLER: str = _active_profile()["chat_handler"]
 
@@ -87,8 +93,19 @@ class CFG:
     # Llama runtime
     N_CTX: int = 2048
     N_THREADS: int = 12
-    N_GPU_LAYERS: int = -1
+    N_GPU_LAYERS: Optional[int] = -1   # -1 = offload all layers; None also means all
     N_BATCH: int = 32
+    N_THREADS_BATCH: Optional[int] = None   # prompt-eval threads; None = N_THREADS
+    USE_MLOCK: bool = False             # pin weights in RAM (needs a high RLIMIT_MEMLOCK)
+    # VRAM-limited hosts: per-GPU split ratios, and a tensor-name regex whose
+    # matches stay on CPU (e.g. r"ffn_.*_exps") while the rest is offloaded.
+    TENSOR_SPLIT: Optional[Tuple[float, ...]] = None
+    OVERRIDE_TENSOR_PATTERN: str = ""
+    # Fused attention kernel; also required by llama.cpp for a quantized V cache
+    FLASH_ATTN: bool = True
+    KV_CACHE_TYPE: str = "q8_0"         # f16 | q8_0 | q4_0 — K/V cache precision
+    PROMPT_CACHE_BYTES: int = 2 << 30   # LlamaRAMCache size for prompt-prefix reuse; 0 disables
+    JSON_GRAMMAR: bool = True           # constrain Qwen3-VL sampling to the action JSON (GBNF)
 
     FORCE_REASONING: bool = False
 
@@ -148,9 +165,6 @@ class CFG:
     MODEL_RETRY: int = 2
     API_READY_TIMEOUT: int = 120  # seconds
 
-    # Sandbox screen size cache (seconds)
-    SCREEN_CACHE_TTL: float = 0.5
-
     # Anti-loop
     REPEAT_CLICK_DISTANCE_PX: int = 10
 
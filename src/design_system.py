@@ -5,6 +5,8 @@ Reference: arayuz.py.py (EyeControl OS blue theme)
 from __future__ import annotations
 from dataclasses import dataclass
 
+from PyQt6.QtGui import QColor, QPalette
+
 @dataclass(frozen=True)
 class Colors:
     BG_DEEPEST: str = "#060e1a"
@@ -42,10 +44,40 @@ S = Sizing()
 
 FONT_FAMILY = '"Segoe UI", "Roboto", "Ubuntu", sans-serif'
 
+def build_palette() -> QPalette:
+    """Application palette carrying the theme colors.
+
+    Apply once via QApplication.setPalette(); build_stylesheet() then only has
+    to carry what a palette cannot express (radii, padding, fonts, per-object
+    accents), which keeps the QSS Qt has to parse small.
+    """
+    Role = QPalette.ColorRole
+    Group = QPalette.ColorGroup
+    pal = QPalette()
+    for role, color in (
+        (Role.Window, C.BG_DEEPEST),
+        (Role.WindowText, C.TEXT),
+        (Role.Base, C.BG_INPUT),
+        (Role.AlternateBase, C.BG_PANEL),
+        (Role.Text, C.TEXT),
+        (Role.PlaceholderText, C.TEXT_MUTED),
+        (Role.Button, C.BG_CARD),
+        (Role.ButtonText, C.TEXT),
+        (Role.Highlight, C.PRIMARY_DARK),
+        (Role.HighlightedText, C.TEXT),
+        (Role.ToolTipBase, C.BG_PANEL),
+        (Role.ToolTipText, C.TEXT),
+        (Role.Link, C.PRIMARY_LIGHT),
+    ):
+        pal.setColor(role, QColor(color))
+    for role in (Role.WindowText, Role.Text, Role.ButtonText):
+        pal.setColor(Group.Disabled, role, QColor(C.TEXT_MUTED))
+    return pal
+
+
 def build_stylesheet() -> str:
     return f"""
     * {{ font-family: {FONT_FAMILY}; }}
-    QMainWindow {{ background: {C.BG_DEEPEST}; }}
 
     /* --- Panels --- */
     QFrame#topBar {{
@@ -83,8 +115,6 @@ def build_stylesheet() -> str:
 
     /* --- Text inputs --- */
     QLineEdit {{
-        background: {C.BG_INPUT};
-        color: {C.TEXT};
         border: 1px solid {C.BORDER};
         border-radius: {S.RADIUS_MD}px;
         padding: 10px 14px;
@@ -96,8 +126,6 @@ def build_stylesheet() -> str:
 
     /* --- Text areas --- */
     QTextEdit {{
-        background: {C.BG_INPUT};
-        color: {C.TEXT};
         border: 1px solid {C.BORDER};
         border-radius: {S.RADIUS_MD}px;
         padding: 8px;
@@ -112,7 +140,6 @@ def build_stylesheet() -> str:
     /* --- Buttons --- */
     QPushButton {{
         background: {C.BG_CARD};
-        color: {C.TEXT};
         border: 1px solid {C.BORDER};
         border-radius: {S.RADIUS_SM}px;
         padding: 8px 16px;
@@ -159,9 +186,6 @@ def build_stylesheet() -> str:
     }}
 
     /* --- Labels --- */
-    QLabel {{
-        color: {C.TEXT};
-    }}
     QLabel#sectionTitle {{
         font-size: 13px;
         font-weight: bold;
@@ -174,7 +198,6 @@ def build_stylesheet() -> str:
     QLabel#metricValue {{
         font-size: 18px;
         font-weight: bold;
-        color: {C.TEXT};
     }}
     QLabel#metricLabel {{
         font-size: 10px;
@@ -183,8 +206,6 @@ def build_stylesheet() -> str:
 
     /* --- List widget --- */
     QListWidget {{
-        background: {C.BG_INPUT};
-        color: {C.TEXT};
         border: 1px solid {C.BORDER};
         border-radius: {S.RADIUS_SM}px;
         font-size: 11px;
@@ -194,9 +215,6 @@ def build_stylesheet() -> str:
         padding: 4px 8px;
         border-radius: 4px;
     }}
-    QListWidget::item:selected {{
-        background: {C.PRIMARY_DARK};
-    }}
 
     /* --- Scroll bars --- */
     QScrollBar:vertical {{
@@ -1,14 +1,30 @@
 # guards.py
 from __future__ import annotations
 
-from typing import Any, Dict, List, Tuple
+import sys
+from typing import Any, Callable, Dict, List, Tuple
+
+import numpy as np
 
 from src.config import cfg
 from src.log import get_logger
 
 log = get_logger("guard")
 
-CLICK_ACTIONS = {"CLICK", "DOUBLE_CLICK", "RIGHT_CLICK"}
+CLICK_ACTIONS = frozenset(map(sys.intern, ("CLICK", "DOUBLE_CLICK", "RIGHT_CLICK")))
+_SYSTEM_FEEDBACK = sys.intern("SYSTEM_FEEDBACK")
+
+# Action categories compared by _model_changed_approach; unlisted actions are
+# their own category
+_ACTION_CATEGORY: Dict[str, str] = {
+    **dict.fromkeys(CLICK_ACTIONS, "click"),
+    **dict.fromkeys(("TYPE", "PRESS", "HOTKEY"), "keyboard"),
+    **dict.fromkeys(("SCROLL", "WAIT", "VISIT_URL", "WEB_SEARCH"), "nav"),
+}
+
+# Click margin is fixed for the process lifetime; bind it once for validate_xy
+_MIN_MARGIN = cfg.MIN_MARGIN
+_ONE_MINUS_MARGIN = 1.0 - _MIN_MARGIN
 
 # Wider tolerance for "same region" (e.g. clicking around the same UI element)
 _REGION_EPS = 0.05  # 5% of screen — catches repeated clicks on the same button/tab
@@ -18,34 +34,94 @@ OK = "ok"
 NUDGE = "nudge"
 STOP = "stop"
 
+# Escalating nudge messages, indexed by nudge_count (last entry repeats).
+# Static text is built once, only the counts vary.
+# Oscillation: {clicks} = clicks in window, {regions} = distinct click regions
+_OSC_MSG_0 = (
+    "You are stuck in a loop: your last {clicks} clicks have all "
+    "landed in the same {regions} area(s). The UI is not responding. "
+    "Try a completely different approach — use keyboard shortcuts, "
+    "scroll to find other elements, or interact with a different part of the screen."
+)
+_OSC_MSG_1 = (
+    "STILL stuck clicking the same {regions} spot(s). Clicking is NOT working. "
+    "STOP clicking and use keyboard actions instead: "
+    "hotkey(key='ctrl l') to focus address bar, type(content='...') to enter text, "
+    "or scroll(direction='down') to see more content."
+)
+_OSC_MSGS = (_OSC_MSG_0, _OSC_MSG_1)
+
+# No-progress: {n} = consecutive actions without a visible screen change
+_NP_MSG_0 = (
+    "Your last {n} actions produced NO visible change on screen. "
+    "The clicks are not landing on interactive elements. "
+    "Try using keyboard shortcuts (e.g., hotkey key='ctrl l' to focus the address bar, "
+    "then type a URL), or scroll to reveal hidden content."
+)
+_NP_MSG_1 = (
+    "STILL no progress after {n} failed actions. "
+    "Clicking is NOT working. You MUST use a keyboard-based approach: "
+    "use hotkey(key='ctrl l') to focus the browser address bar, "
+    "then type(content='https://...') to navigate directly. "
+    "Or use hotkey(key='ctrl t') to open a new tab."
+)
+_NP_MSG_2 = (
+    "FINAL WARNING: {n} consecutive actions with zero effect. "
+    "Stop clicking. Use ONLY keyboard actions: "
+    "hotkey(key='ctrl l') then type(content='your URL here'). "
+    "This is your last chance before the task is terminated."
+)
+_NO_PROGRESS_MSGS = (_NP_MSG_0, _NP_MSG_1, _NP_MSG_2)
+
+
+def _action_name(act: Dict[str, Any], default: str = "") -> str:
+    """Upper-cased, interned action name so later comparisons hit the identity fast path."""
+    return sys.intern((act.get("action") or default).upper())
+
 
 def validate_xy(x: float, y: float) -> Tuple[bool, str]:
     if not (0.0 <= x <= 1.0 and 0.0 <= y <= 1.0):
         return False, "x/y out of [0,1]"
-    if x < cfg.MIN_MARGIN or x > (1.0 - cfg.MIN_MARGIN) or y < cfg.MIN_MARGIN or y > (1.0 - cfg.MIN_MARGIN):
-        return False, f"x/y too close to edge (margin={cfg.MIN_MARGIN})"
+    if x < _MIN_MARGIN or x > _ONE_MINUS_MARGIN or y < _MIN_MARGIN or y > _ONE_MINUS_MARGIN:
+        return False, f"x/y too close to edge (margin={_MIN_MARGIN})"
     return True, ""
 
 
+def validate_xy_batch(xy: np.ndarray) -> np.ndarray:
+    """Vectorized validate_xy for an (N, 2) array of normalized points.
+
+    Returns a boolean mask, True where the point is inside [0,1] and clear of
+    the edge margin. Use validate_xy() when a human-readable reason is needed.
+    """
+    xy = np.asarray(xy, dtype=np.float64).reshape(-1, 2)
+    return ((xy >= _MIN_MARGIN) & (xy <= _ONE_MINUS_MARGIN)).all(axis=1)
+
+
+def _click_sig(act: Dict[str, Any]) -> str:
+    return f"{float(act.get('x', 0)):.4f},{float(act.get('y', 0)):.4f}"
+
+
+# action name -> signature detail (after "NAME:"); names not listed sign as just the name
+_SIG_DETAIL: Dict[str, Callable[[Dict[str, Any]], str]] = {
+    "CLICK": _click_sig,
+    "DOUBLE_CLICK": _click_sig,
+    "RIGHT_CLICK": _click_sig,
+    "TYPE": lambda act: str(act.get("text", "")),
+    "PRESS": lambda act: str(act.get("key", "")),
+    "HOTKEY": lambda act: ",".join(act.get("keys") or []),
+    "SCROLL": lambda act: str(int(act.get("scroll", 0))),
+    "WAIT": lambda act: str(float(act.get("seconds", 0))),
+    "VISIT_URL": lambda act: str(act.get("url", "")),
+    "WEB_SEARCH": lambda act: str(act.get("query", "")),
+}
+
+
 def action_signature(act: Dict[str, Any]) -> str:
-    a = (act.get("action") or "NOOP").upper()
-    if a in CLICK_ACTIONS:
-        return f"{a}:{float(act.get('x', 0)):.4f},{float(act.get('y', 0)):.4f}"
-    if a == "TYPE":
-        return f"TYPE:{act.get('text','')}"
-    if a == "PRESS":
-        return f"PRESS:{act.get('key','')}"
-    if a == "HOTKEY":
-        return f"HOTKEY:{','.join(act.get('keys') or [])}"
-    if a == "SCROLL":
-        return f"SCROLL:{int(act.get('scroll',0))}"
-    if a == "WAIT":
-        return f"WAIT:{float(act.get('seconds',0))}"
-    if a == "VISIT_URL":
-        return f"VISIT_URL:{act.get('url','')}"
-    if a == "WEB_SEARCH":
-        return f"WEB_SEARCH:{act.get('query','')}"
-    return a
+    a = _action_name(act, "NOOP")
+    detail_fn = _SIG_DETAIL.get(a)
+    if detail_fn is None:
+        return a
+    return f"{a}:{detail_fn(act)}"
 
 
 def _same_xy(a, b, eps: float) -> bool:
@@ -56,12 +132,12 @@ def _same_xy(a, b, eps: float) -> bool:
 
 
 def _is_click(act: Dict[str, Any]) -> bool:
-    return (act.get("action") or "").upper() in CLICK_ACTIONS
+    return _action_name(act) in CLICK_ACTIONS
 
 
 def _real_actions(history: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     """Filter out SYSTEM_FEEDBACK entries so detection windows only count real actions."""
-    return [h for h in history if (h.get("action") or "").upper() != "SYSTEM_FEEDBACK"]
+    return [h for h in history if _action_name(h) is not _SYSTEM_FEEDBACK]
 
 
 def _actions_since_last_nudge(history: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
@@ -72,7 +148,7 @@ def _actions_since_last_nudge(history: List[Dict[str, Any]]) -> List[Dict[str, A
     # Walk backwards to find the last SYSTEM_FEEDBACK
     last_nudge_idx = -1
     for i in range(len(history) - 1, -1, -1):
-        if (history[i].get("action") or "").upper() == "SYSTEM_FEEDBACK":
+        if _action_name(history[i]) is _SYSTEM_FEEDBACK:
             last_nudge_idx = i
             break
 
@@ -93,33 +169,22 @@ def _model_changed_approach(history: List[Dict[str, Any]], new_action: Dict[str,
         return False
 
     last = history[-1]
-    if (last.get("action") or "").upper() != "SYSTEM_FEEDBACK":
+    if _action_name(last) is not _SYSTEM_FEEDBACK:
         return False
 
-    new_type = (new_action.get("action") or "").upper()
+    new_type = _action_name(new_action)
 
     # Check what the last real action was (before the feedback)
-    real = _real_actions(history)
-    if not real:
+    for h in reversed(history):
+        last_real_type = _action_name(h)
+        if last_real_type is not _SYSTEM_FEEDBACK:
+            break
+    else:
         return True  # no previous action to compare
 
-    last_real_type = (real[-1].get("action") or "").upper()
-
     # "Changed approach" = different action category
-    click_types = CLICK_ACTIONS
-    keyboard_types = {"TYPE", "PRESS", "HOTKEY"}
-    nav_types = {"SCROLL", "WAIT", "VISIT_URL", "WEB_SEARCH"}
-
-    def category(t: str) -> str:
-        if t in click_types:
-            return "click"
-        if t in keyboard_types:
-            return "keyboard"
-        if t in nav_types:
-            return "nav"
-        return t
-
-    changed = category(new_type) != category(last_real_type)
+    changed = (_ACTION_CATEGORY.get(new_type, new_type)
+               != _ACTION_CATEGORY.get(last_real_type, last_real_type))
     if changed:
         log.info("Model changed approach: %s -> %s (allowing through)", last_real_type, new_type)
     return changed
@@ -153,21 +218,8 @@ def _detect_oscillation(history: List[Dict[str, Any]], new_action: Dict[str, Any
             regions.append({"x": cx, "y": cy, "count": 1})
 
     if len(regions) <= 2 and len(clicks) >= 5:
-        if nudge_count == 0:
-            msg = (
-                f"You are stuck in a loop: your last {len(clicks)} clicks have all "
-                f"landed in the same {len(regions)} area(s). The UI is not responding. "
-                "Try a completely different approach — use keyboard shortcuts, "
-                "scroll to find other elements, or interact with a different part of the screen."
-            )
-        else:
-            msg = (
-                f"STILL stuck clicking the same {len(regions)} spot(s). Clicking is NOT working. "
-                "STOP clicking and use keyboard actions instead: "
-                "hotkey(key='ctrl l') to focus address bar, type(content='...') to enter text, "
-                "or scroll(direction='down') to see more content."
-            )
-        return True, msg
+        tmpl = _OSC_MSGS[min(nudge_count, len(_OSC_MSGS) - 1)]
+        return True, tmpl.format(clicks=len(clicks), regions=len(regions))
 
     return False, ""
 
@@ -193,110 +245,111 @@ def _detect_no_progress(history: List[Dict[str, Any]], new_action: Dict[str, Any
 
     if no_change_count >= window:
         # Escalate the message based on how many nudges have already been given
-        if nudge_count == 0:
-            msg = (
-                f"Your last {no_change_count} actions produced NO visible change on screen. "
-                "The clicks are not landing on interactive elements. "
-                "Try using keyboard shortcuts (e.g., hotkey key='ctrl l' to focus the address bar, "
-                "then type a URL), or scroll to reveal hidden content."
-            )
-        elif nudge_count == 1:
-            msg = (
-                f"STILL no progress after {no_change_count} failed actions. "
-                "Clicking is NOT working. You MUST use a keyboard-based approach: "
-                "use hotkey(key='ctrl l') to focus the browser address bar, "
-                "then type(content='https://...') to navigate directly. "
-                "Or use hotkey(key='ctrl t') to open a new tab."
-            )
-        else:
-            msg = (
-                f"FINAL WARNING: {no_change_count} consecutive actions with zero effect. "
-                "Stop clicking. Use ONLY keyboard actions: "
-                "hotkey(key='ctrl l') then type(content='your URL here'). "
-                "This is your last chance before the task is terminated."
-            )
-        return True, msg
+        tmpl = _NO_PROGRESS_MSGS[min(nudge_count, len(_NO_PROGRESS_MSGS) - 1)]
+        return True, tmpl.format(n=no_change_count)
 
     return False, ""
 
 
-def _detect_direct_repeat(history: List[Dict[str, Any]], new_action: Dict[str, Any]) -> Tuple[bool, str]:
-    """Detect direct A->A->A repetition patterns."""
-    real = _real_actions(history)
-    if not real:
-        return False, ""
+def _check_type_repeat(real: List[Dict[str, Any]], new_action: Dict[str, Any]) -> Tuple[bool, str]:
+    """TYPE: 3 consecutive identical texts."""
+    if len(real) >= 2:
+        last, prev2 = real[-1], real[-2]
+        if (_action_name(prev2) == "TYPE"
+                and (prev2.get("text") or "") == (last.get("text") or "")
+                and (last.get("text") or "") == (new_action.get("text") or "")):
+            return True, (
+                f"You are trying to type '{new_action.get('text', '')[:40]}' for the 3rd time in a row. "
+                "This text has already been entered. Check if the input field already has your text, "
+                "or try clicking on the correct input field first before typing."
+            )
+    return False, ""
 
-    last = real[-1]
-    a1 = (last.get("action") or "").upper()
-    a2 = (new_action.get("action") or "").upper()
 
-    if a1 != a2:
-        return False, ""
+def _check_press_repeat(real: List[Dict[str, Any]], new_action: Dict[str, Any]) -> Tuple[bool, str]:
+    """PRESS: 2 consecutive identical."""
+    if (real[-1].get("key") or "") == (new_action.get("key") or ""):
+        return True, (
+            f"You are pressing '{new_action.get('key', '')}' again with no effect. "
+            "Try a different key or a different approach entirely."
+        )
+    return False, ""
 
-    # TYPE: 3 consecutive identical texts
-    if a2 == "TYPE":
-        if len(real) >= 2:
-            prev2 = real[-2]
-            if ((prev2.get("action") or "").upper() == "TYPE"
-                    and (prev2.get("text") or "") == (last.get("text") or "")
-                    and (last.get("text") or "") == (new_action.get("text") or "")):
-                return True, (
-                    f"You are trying to type '{new_action.get('text', '')[:40]}' for the 3rd time in a row. "
-                    "This text has already been entered. Check if the input field already has your text, "
-                    "or try clicking on the correct input field first before typing."
-                )
-
-    # PRESS: 2 consecutive identical
-    if a2 == "PRESS":
-        if (last.get("key") or "") == (new_action.get("key") or ""):
-            return True, (
-                f"You are pressing '{new_action.get('key', '')}' again with no effect. "
-                "Try a different key or a different approach entirely."
-            )
 
-    # HOTKEY: 2 consecutive identical
-    if a2 == "HOTKEY":
-        if (last.get("keys") or []) == (new_action.get("keys") or []):
-            keys_str = "+".join(new_action.get("keys") or [])
-            return True, (
-                f"You are pressing '{keys_str}' again with no effect. "
-                "Try a different shortcut or interact with the UI directly."
-            )
+def _check_hotkey_repeat(real: List[Dict[str, Any]], new_action: Dict[str, Any]) -> Tuple[bool, str]:
+    """HOTKEY: 2 consecutive identical."""
+    if (real[-1].get("keys") or []) == (new_action.get("keys") or []):
+        keys_str = "+".join(new_action.get("keys") or [])
+        return True, (
+            f"You are pressing '{keys_str}' again with no effect. "
+            "Try a different shortcut or interact with the UI directly."
+        )
+    return False, ""
 
-    # CLICK: 3 consecutive at exact same coords
-    if a2 in CLICK_ACTIONS:
-        eps = float(getattr(cfg, "REPEAT_XY_EPS", 0.01))
-        if len(real) >= 2:
-            prev2 = real[-2]
-            if (_is_click(prev2) and _same_xy(prev2, new_action, eps)
-                    and _is_click(last) and _same_xy(last, new_action, eps)):
-                return True, (
-                    "You have clicked the exact same spot 3 times in a row. "
-                    "The element is not responding as expected. Try clicking somewhere else, "
-                    "double-clicking, right-clicking, or using keyboard navigation instead."
-                )
-
-    # VISIT_URL: 2 consecutive identical URLs
-    if a2 == "VISIT_URL":
-        if (last.get("url") or "") == (new_action.get("url") or ""):
-            return True, (
-                "You already tried visit_url with the same URL and it had no effect. "
-                "A browser window must be open first. Look at the screenshot — "
-                "if no browser is visible, open Firefox by clicking its desktop icon."
-            )
 
-    # WEB_SEARCH: 2 consecutive identical queries
-    if a2 == "WEB_SEARCH":
-        if (last.get("query") or "") == (new_action.get("query") or ""):
+def _check_click_repeat(real: List[Dict[str, Any]], new_action: Dict[str, Any]) -> Tuple[bool, str]:
+    """CLICK: 3 consecutive at exact same coords."""
+    eps = float(getattr(cfg, "REPEAT_XY_EPS", 0.01))
+    if len(real) >= 2:
+        last, prev2 = real[-1], real[-2]
+        if (_is_click(prev2) and _same_xy(prev2, new_action, eps)
+                and _is_click(last) and _same_xy(last, new_action, eps)):
             return True, (
-                "You already tried web_search with the same query and it had no effect. "
-                "A browser window must be open first. Look at the screenshot — "
-                "if no browser is visible, open Firefox by clicking its desktop icon."
+                "You have clicked the exact same spot 3 times in a row. "
+                "The element is not responding as expected. Try clicking somewhere else, "
+                "double-clicking, right-clicking, or using keyboard navigation instead."
             )
+    return False, ""
+
 
+def _check_visit_url_repeat(real: List[Dict[str, Any]], new_action: Dict[str, Any]) -> Tuple[bool, str]:
+    """VISIT_URL: 2 consecutive identical URLs."""
+    if (real[-1].get("url") or "") == (new_action.get("url") or ""):
+        return True, (
+            "You already tried visit_url with the same URL and it had no effect. "
+            "A browser window must be open first. Look at the screenshot — "
+            "if no browser is visible, open Firefox by clicking its desktop icon."
+        )
     return False, ""
 
 
+def _check_web_search_repeat(real: List[Dict[str, Any]], new_action: Dict[str, Any]) -> Tuple[bool, str]:
+    """WEB_SEARCH: 2 consecutive identical queries."""
+    if (real[-1].get("query") or "") == (new_action.get("query") or ""):
+        return True, (
+            "You already tried web_search with the same query and it had no effect. "
+            "A browser window must be open first. Look at the screenshot — "
+            "if no browser is visible, open Firefox by clicking its desktop icon."
+        )
+    return False, ""
+
+
+# Per-action-type repeat checkers, called only when the last real action has the same type
+_REPEAT_CHECKERS = {
+    "TYPE": _check_type_repeat,
+    "PRESS": _check_press_repeat,
+    "HOTKEY": _check_hotkey_repeat,
+    "CLICK": _check_click_repeat,
+    "DOUBLE_CLICK": _check_click_repeat,
+    "RIGHT_CLICK": _check_click_repeat,
+    "VISIT_URL": _check_visit_url_repeat,
+    "WEB_SEARCH": _check_web_search_repeat,
+}
+
+
+def _detect_direct_repeat(history: List[Dict[str, Any]], new_action: Dict[str, Any]) -> Tuple[bool, str]:
+    """Detect direct A->A->A repetition patterns."""
+    real = _real_actions(history)
+    if not real:
+        return False, ""
+
+    a2 = _action_name(new_action)
+    checker = _REPEAT_CHECKERS.get(a2)
+    if checker is None or _action_name(real[-1]) is not a2:
+        return False, ""
+    return checker(real, new_action)
+
+
 def check_repeat(history: List[Dict[str, Any]], new_action: Dict[str, Any],
                  nudge_count: int = 0) -> Tuple[str, str]:
     """Check if the model is stuck in a repetition loop.
@@ -1,20 +1,33 @@
 # llm_client.py
 from __future__ import annotations
 
+import ast
+import functools
 import json
+import logging
 import math
 import re
-from typing import Any, Dict, List, Optional, Tuple
+from collections import deque
+from types import MappingProxyType
+from typing import Any, Callable, Deque, Dict, List, Mapping, Optional, Tuple
 
 from huggingface_hub import hf_hub_download
 from llama_cpp import Llama
 
 from src.config import cfg, JSON_RE
 from src.log import get_logger
-from src.vision import image_to_data_uri
+from src.vision import image_payload, resized_image_data_uri
 
 log = get_logger("llm")
 
+# orjson is optional; its JSONDecodeError subclasses json.JSONDecodeError,
+# so callers only need to catch the stdlib exception.
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
 
 # ═══════════════════════════════════════════
 # Model loading
@@ -39,53 +52,353 @@ def _make_chat_handler(handler_type: str, mmproj_path: str):
     raise ValueError(f"Unknown chat handler type: {handler_type}")
 
 
+# ggml_type ids accepted by Llama(type_k=..., type_v=...)
+_GGML_KV_TYPES: Dict[str, int] = {
+    "f16": 1, "q4_0": 2, "q4_1": 3, "q5_0": 6, "q5_1": 7, "q8_0": 8,
+}
+# Bytes per element: quantized types store 32-element blocks plus scales
+_GGML_KV_BYTES: Dict[str, float] = {
+    "f16": 2.0, "q4_0": 18 / 32, "q4_1": 20 / 32, "q5_0": 22 / 32, "q5_1": 24 / 32, "q8_0": 34 / 32,
+}
+
+
+def _kv_cache_bytes(llm: Llama, n_ctx: int, k_type: str, v_type: str) -> Optional[int]:
+    """Estimate the KV cache size from the GGUF metadata, or None if unknown."""
+    meta = getattr(llm, "metadata", None) or {}
+    arch = meta.get("general.architecture")
+    try:
+        n_layer = int(meta[f"{arch}.block_count"])
+        n_head = int(meta[f"{arch}.attention.head_count"])
+        n_head_kv = int(meta.get(f"{arch}.attention.head_count_kv", n_head))
+        head_dim = int(meta[f"{arch}.embedding_length"]) // n_head
+        k_dim = int(meta.get(f"{arch}.attention.key_length", head_dim))
+        v_dim = int(meta.get(f"{arch}.attention.value_length", head_dim))
+    except (KeyError, ValueError, ZeroDivisionError):
+        return None
+    per_token = n_head_kv * (k_dim * _GGML_KV_BYTES[k_type] + v_dim * _GGML_KV_BYTES[v_type])
+    return int(n_layer * n_ctx * per_token)
+
+
+def _log_context_features(llm: Llama) -> None:
+    """Report which attention/KV-cache settings the context actually got."""
+    params = getattr(llm, "context_params", None)
+    if params is None:
+        return
+    log.info("  flash_attn: %s  type_k: %s  type_v: %s",
+             getattr(params, "flash_attn", "?"),
+             getattr(params, "type_k", "?"), getattr(params, "type_v", "?"))
+
+
+def _check_gpu_offload(llm: Llama, n_gpu_layers: int) -> None:
+    """Warn when layers were requested on GPU but the llama.cpp build is CPU-only.
+
+    llama.cpp silently runs everything on CPU in that case, which is an order
+    of magnitude slower at decode.
+    """
+    try:
+        from llama_cpp import llama_supports_gpu_offload
+    except ImportError:
+        return
+    offloaded = getattr(getattr(llm, "model_params", None), "n_gpu_layers", n_gpu_layers)
+    if n_gpu_layers != 0 and not llama_supports_gpu_offload():
+        log.warning("n_gpu_layers=%s requested but this llama-cpp-python build has no GPU "
+                    "offload support — running on CPU", n_gpu_layers)
+    else:
+        log.info("  gpu offload: %s layers", "all" if offloaded == -1 else offloaded)
+
+
+# Minimum prompt-eval batch when layers are offloaded to GPU
+_GPU_MIN_N_BATCH = 1024
+
+
+def _effective_n_batch(n_gpu_layers: int) -> int:
+    """cfg.N_BATCH, raised to _GPU_MIN_N_BATCH on GPU and capped at n_ctx.
+
+    Prompt eval (system prompt + image tokens) dominates each step; on GPU a
+    bigger batch means fewer, fuller GEMM launches. CPU-only keeps the
+    configured value since large batches hurt cache locality there.
+    """
+    n_batch = cfg.N_BATCH
+    if n_gpu_layers != 0:
+        n_batch = max(n_batch, _GPU_MIN_N_BATCH)
+    return min(n_batch, cfg.N_CTX)
+
+
+def _hf_download(filename: str) -> str:
+    """Resolve a file from cfg.GGUF_REPO_ID, using the local HF cache if it is there.
+
+    A plain hf_hub_download revalidates the ETag over the network even on a
+    cache hit; local_files_only skips that round-trip (and works offline).
+    """
+    try:
+        return hf_hub_download(repo_id=cfg.GGUF_REPO_ID, filename=filename, local_files_only=True)
+    except Exception:
+        return hf_hub_download(repo_id=cfg.GGUF_REPO_ID, filename=filename)
+
+
+def _download_model_weights() -> str:
+    """Prefer the profile's lower-bit GGUF; fall back to GGUF_MODEL_FILENAME."""
+    if cfg.GGUF_MODEL_FILENAME_QUANT:
+        try:
+            return _hf_download(cfg.GGUF_MODEL_FILENAME_QUANT)
+        except Exception as e:
+            log.warning("Quantized weights %s unavailable (%s) — falling back to %s",
+                        cfg.GGUF_MODEL_FILENAME_QUANT, e, cfg.GGUF_MODEL_FILENAME)
+    return _hf_download(cfg.GGUF_MODEL_FILENAME)
+
+
 def load_llm() -> Llama:
+    n_gpu_layers = cfg.N_GPU_LAYERS if cfg.N_GPU_LAYERS is not None else -1
+
     log.info("Loading model: %s", cfg.MODEL_NAME)
     log.info("  repo:    %s", cfg.GGUF_REPO_ID)
-    log.info("  model:   %s", cfg.GGUF_MODEL_FILENAME)
+    log.info("  model:   %s", cfg.GGUF_MODEL_FILENAME_QUANT or cfg.GGUF_MODEL_FILENAME)
     log.info("  mmproj:  %s", cfg.GGUF_MMPROJ_FILENAME)
     log.info("  handler: %s", cfg.CHAT_HANDLER)
-    log.info("  n_ctx: %d  n_batch: %d", cfg.N_CTX, cfg.N_BATCH)
-    log.info("  n_gpu_layers: %s (%s)", cfg.N_GPU_LAYERS,
-             "all" if cfg.N_GPU_LAYERS == -1 else cfg.N_GPU_LAYERS)
+    n_batch = _effective_n_batch(n_gpu_layers)
+    log.info("  n_ctx: %d  n_batch/n_ubatch: %d", cfg.N_CTX, n_batch)
+    log.info("  n_gpu_layers: %s (%s)", n_gpu_layers,
+             "all" if n_gpu_layers == -1 else n_gpu_layers)
 
-    model_path = hf_hub_download(repo_id=cfg.GGUF_REPO_ID, filename=cfg.GGUF_MODEL_FILENAME)
-    mmproj_path = hf_hub_download(repo_id=cfg.GGUF_REPO_ID, filename=cfg.GGUF_MMPROJ_FILENAME)
+    model_path = _download_model_weights()
+    mmproj_path = _hf_download(cfg.GGUF_MMPROJ_FILENAME)
 
     handler = _make_chat_handler(cfg.CHAT_HANDLER, mmproj_path)
 
-    return Llama(
+    kwargs: Dict[str, Any] = {}
+    if cfg.TENSOR_SPLIT:
+        kwargs["tensor_split"] = list(cfg.TENSOR_SPLIT)
+        log.info("  tensor_split: %s", kwargs["tensor_split"])
+    if cfg.OVERRIDE_TENSOR_PATTERN:
+        # Keep matching tensors on CPU, offload everything else
+        kwargs["override_tensor"] = f"{cfg.OVERRIDE_TENSOR_PATTERN}=CPU"
+        log.info("  override_tensor: %s", kwargs["override_tensor"])
+
+    kv_type = _GGML_KV_TYPES.get(cfg.KV_CACHE_TYPE.lower())
+    if kv_type is None:
+        raise ValueError(f"Unknown KV_CACHE_TYPE: {cfg.KV_CACHE_TYPE}")
+    k_name = cfg.KV_CACHE_TYPE.lower()
+    # llama.cpp only supports a quantized V cache together with flash attention
+    v_name = k_name if cfg.FLASH_ATTN else "f16"
+    kwargs["type_k"] = kv_type
+    kwargs["type_v"] = _GGML_KV_TYPES[v_name]
+
+    kwargs.update(
         model_path=model_path,
         chat_handler=handler,
         n_ctx=cfg.N_CTX,
-        n_batch=cfg.N_BATCH,
-        n_gpu_layers=cfg.N_GPU_LAYERS,
+        n_batch=n_batch,
+        n_ubatch=n_batch,
+        n_gpu_layers=n_gpu_layers,
         n_threads=cfg.N_THREADS,
+        n_threads_batch=cfg.N_THREADS_BATCH or cfg.N_THREADS,
+        use_mmap=True,
+        use_mlock=cfg.USE_MLOCK,
+        offload_kqv=True,
+        flash_attn=cfg.FLASH_ATTN,
         verbose=False,
     )
+    try:
+        llm = Llama(**kwargs)
+    except ValueError as e:
+        # Builds without GGML_CUDA_FA_ALL_QUANTS cannot create a context with
+        # some quantized K/V combinations — retry once with an f16 cache.
+        if k_name == v_name == "f16":
+            raise
+        log.warning("Context with %s/%s KV cache failed (%s) — retrying with f16", k_name, v_name, e)
+        k_name = v_name = "f16"
+        kwargs["type_k"] = kwargs["type_v"] = _GGML_KV_TYPES["f16"]
+        llm = Llama(**kwargs)
+    _check_gpu_offload(llm, n_gpu_layers)
+    _log_context_features(llm)
+    kv_bytes = _kv_cache_bytes(llm, cfg.N_CTX, k_name, v_name)
+    if kv_bytes is not None:
+        log.info("  kv cache: ~%d MB (K %s, V %s)", kv_bytes >> 20, k_name, v_name)
+
+    if cfg.PROMPT_CACHE_BYTES > 0:
+        # Keep evaluated prompt states so a shared system+history prefix is not re-evaluated
+        from llama_cpp import LlamaRAMCache
+        llm.set_cache(LlamaRAMCache(capacity_bytes=cfg.PROMPT_CACHE_BYTES))
+        log.info("  prompt cache: %d MB (RAM)", cfg.PROMPT_CACHE_BYTES >> 20)
+    return llm
+
+
+# ═══════════════════════════════════════════
+# Streaming with early stop
+# ═══════════════════════════════════════════
+
+def _stream_completion(llm: Llama, is_done: Callable[[str], bool], **kwargs) -> Tuple[str, str]:
+    """Stream a chat completion and stop as soon as is_done(piece) returns True.
+
+    Returns (text, finish_reason); finish_reason is "early_stop" when we cut
+    generation ourselves. Closing the generator stops llama.cpp decoding.
+    """
+    parts: List[str] = []
+    finish = "?"
+    stream = llm.create_chat_completion(stream=True, **kwargs)
+    try:
+        for chunk in stream:
+            choice = chunk["choices"][0]
+            piece = choice.get("delta", {}).get("content") or ""
+            if piece:
+                parts.append(piece)
+                if is_done(piece):
+                    finish = "early_stop"
+                    break
+            if choice.get("finish_reason"):
+                finish = choice["finish_reason"]
+    finally:
+        close = getattr(stream, "close", None)
+        if close is not None:
+            close()
+    return "".join(parts), finish
+
+
+def _json_object_closed() -> Callable[[str], bool]:
+    """Incremental matcher: True once the first top-level {...} has closed.
+
+    Braces inside string literals (with backslash escapes) are ignored.
+    """
+    depth = 0
+    in_str = False
+    escaped = False
+
+    def feed(piece: str) -> bool:
+        nonlocal depth, in_str, escaped
+        for ch in piece:
+            if in_str:
+                if escaped:
+                    escaped = False
+                elif ch == "\\":
+                    escaped = True
+                elif ch == '"':
+                    in_str = False
+            elif ch == '"':
+                in_str = depth > 0
+            elif ch == "{":
+                depth += 1
+            elif ch == "}" and depth > 0:
+                depth -= 1
+                if depth == 0:
+                    return True
+        return False
+
+    return feed
 
 
 # ═══════════════════════════════════════════
 # Qwen3-VL prompt & parser  (JSON output)
 # ═══════════════════════════════════════════
 
+def _skip_ws(raw: str, i: int) -> int:
+    n = len(raw)
+    while i < n and raw[i].isspace():
+        i += 1
+    return i
+
+
+def _scan_number(raw: str, i: int) -> int:
+    """Return the end index of an unsigned decimal (42, 0.5) starting at i, or i if none."""
+    n = len(raw)
+    j = i
+    while j < n and raw[j].isdigit():
+        j += 1
+    if j == i:
+        return i
+    if j + 1 < n and raw[j] == "." and raw[j + 1].isdigit():
+        j += 2
+        while j < n and raw[j].isdigit():
+            j += 1
+    return j
+
+
+def _scan_xy_pair(raw: str, i: int) -> Optional[Tuple[str, str, int]]:
+    """Match ': 42, 129,' right after a "x" key.
+
+    Returns (x, y, index of the comma after y) or None if the text is not the
+    malformed pair shape.
+    """
+    i = _skip_ws(raw, i)
+    if i >= len(raw) or raw[i] != ":":
+        return None
+    i = _skip_ws(raw, i + 1)
+    end = _scan_number(raw, i)
+    if end == i:
+        return None
+    x = raw[i:end]
+    i = _skip_ws(raw, end)
+    if i >= len(raw) or raw[i] != ",":
+        return None
+    i = _skip_ws(raw, i + 1)
+    end = _scan_number(raw, i)
+    if end == i:
+        return None
+    y = raw[i:end]
+    i = _skip_ws(raw, end)
+    if i >= len(raw) or raw[i] != ",":
+        return None
+    return x, y, i
+
+
+_TRAILING_COMMA_RE = re.compile(r",\s*}")
+
+
 def _fix_malformed_json(raw: str) -> str:
-    """Fix common model JSON issues like 'x': 42, 129, -> 'x': 42, 'y': 129,"""
-    raw = re.sub(
-        r'"x"\s*:\s*(\d+(?:\.\d+)?)\s*,\s*(\d+(?:\.\d+)?)\s*,',
-        r'"x": \1, "y": \2,',
-        raw,
-    )
-    raw = re.sub(r',\s*}', '}', raw)
-    return raw
+    """Fix common model JSON issues like 'x': 42, 129, -> 'x': 42, 'y': 129,
+
+    Single pass over the text, skipping string literals. Also drops trailing
+    commas before '}'. Only runs after json.loads has already failed.
+    """
+    # C-level prechecks: nothing to rewrite means no Python-level scan
+    if '"x"' not in raw and _TRAILING_COMMA_RE.search(raw) is None:
+        return raw
+    out: List[str] = []
+    n = len(raw)
+    i = 0
+    in_str = False
+    while i < n:
+        ch = raw[i]
+        if in_str:
+            if ch == "\\" and i + 1 < n:
+                out.append(raw[i:i + 2])
+                i += 2
+                continue
+            out.append(ch)
+            if ch == '"':
+                in_str = False
+            i += 1
+            continue
+
+        if ch == '"':
+            if raw.startswith('"x"', i):
+                pair = _scan_xy_pair(raw, i + 3)
+                if pair is not None:
+                    x, y, i = pair
+                    # Resume at the comma so the trailing-comma rule still applies
+                    out.append(f'"x": {x}, "y": {y}')
+                    continue
+            in_str = True
+        elif ch == ",":
+            j = _skip_ws(raw, i + 1)
+            if j < n and raw[j] == "}":
+                i = j
+                continue
+        out.append(ch)
+        i += 1
+    return "".join(out)
+
+
+_INV_MAX_DIM = 1.0 / cfg.MAX_DIM
 
 
 def _normalize_coords(obj: Dict[str, Any]) -> Dict[str, Any]:
     """If x/y appear to be pixel coords (>1.0), normalize to 0-1 using MAX_DIM."""
-    for key in ("x", "y"):
-        val = obj.get(key)
-        if isinstance(val, (int, float)) and val > 1.0:
-            obj[key] = val / cfg.MAX_DIM
+    x = obj.get("x")
+    if isinstance(x, (int, float)) and x > 1.0:
+        obj["x"] = x * _INV_MAX_DIM
+    y = obj.get("y")
+    if isinstance(y, (int, float)) and y > 1.0:
+        obj["y"] = y * _INV_MAX_DIM
     return obj
 
 
@@ -95,10 +408,10 @@ def _parse_json_obj(text: str) -> Dict[str, Any]:
         raise ValueError(f"Model output is not JSON: {text}")
     raw = m.group(0)
     try:
-        return _normalize_coords(json.loads(raw))
+        return _normalize_coords(_json_loads(raw))
     except json.JSONDecodeError:
         fixed = _fix_malformed_json(raw)
-        return _normalize_coords(json.loads(fixed))
+        return _normalize_coords(_json_loads(fixed))
 
 
 _QWEN3VL_SYSTEM = (
@@ -135,58 +448,130 @@ _QWEN3VL_SYSTEM = (
 )
 
 
+# Per-entry formatted history lines, keyed by id(entry). The entry is stored with
+# its line so a recycled id never matches, and screen_changed is compared because
+# the agent loop annotates the last entry after it was first formatted.
+_HistoryLineCache = Dict[int, Tuple[Dict[str, Any], Any, str]]
+_HISTORY_LINE_CACHE_MAX = 256
+_qwen3vl_line_cache: _HistoryLineCache = {}
+_uitars_line_cache: _HistoryLineCache = {}
+
+
+def _cached_history_line(cache: _HistoryLineCache, h: Dict[str, Any],
+                         fmt: Callable[[Dict[str, Any]], str]) -> str:
+    """Return fmt(h), reusing the previous result while the entry is unchanged."""
+    sc = h.get("screen_changed")
+    hit = cache.get(id(h))
+    if hit is not None and hit[0] is h and hit[1] is sc:
+        return hit[2]
+    line = fmt(h)
+    if len(cache) >= _HISTORY_LINE_CACHE_MAX:
+        cache.clear()
+    cache[id(h)] = (h, sc, line)
+    return line
+
+
+def _click_detail(h: Dict[str, Any]) -> str:
+    hx, hy = h.get("x"), h.get("y")
+    if isinstance(hx, (int, float)) and isinstance(hy, (int, float)):
+        return f"at ({hx:.4f}, {hy:.4f})"
+    return ""
+
+
+def _type_detail(h: Dict[str, Any]) -> str:
+    text = h.get("text")
+    return f"'{text[:40]}'" if text else ""
+
+
+# Action -> short argument description for the history line ("" = omit)
+_QWEN3VL_ACTION_DETAIL: Dict[str, Callable[[Dict[str, Any]], str]] = {
+    "CLICK": _click_detail,
+    "DOUBLE_CLICK": _click_detail,
+    "RIGHT_CLICK": _click_detail,
+    "TYPE": _type_detail,
+    "PRESS": lambda h: h.get("key") or "",
+    "HOTKEY": lambda h: "+".join(h.get("keys") or []),
+    "SCROLL": lambda h: str(h.get("scroll", 0)),
+}
+
+# screen_changed -> marker appended to the history line (None/missing: nothing)
+_QWEN3VL_SC_SUFFIX = {False: "❌ NO EFFECT", True: "✓"}
+
+
+def _qwen3vl_history_line(h: Dict[str, Any]) -> str:
+    """One history entry for Qwen3-VL, without the 'Step N:' prefix."""
+    act = h.get("action", "?")
+
+    if act == "SYSTEM_FEEDBACK":
+        feedback = h.get("target", "")
+        return f"⚠️ WARNING: {feedback}"
+
+    # Build a short description of what was done (only non-empty parts)
+    desc_parts = [act] if act else []
+    detail_fn = _QWEN3VL_ACTION_DETAIL.get(act)
+    if detail_fn is not None:
+        detail = detail_fn(h)
+        if detail:
+            desc_parts.append(detail)
+
+    target = h.get("target", h.get("why_short", ""))
+    if target:
+        if len(target) > 60:
+            target = target[:57] + "..."
+        desc_parts.append(f"— {target}")
+
+    suffix = _QWEN3VL_SC_SUFFIX.get(h.get("screen_changed"))
+    if suffix:
+        desc_parts.append(suffix)
+
+    return " ".join(desc_parts)
+
+
 def _format_qwen3vl_history(history: List[Dict[str, Any]]) -> str:
     """Convert internal history to human-readable text for Qwen3-VL.
 
     Marks failed actions with ❌ and prominently displays SYSTEM_FEEDBACK warnings.
+    Only entries that are new or changed since the last call are re-formatted.
     """
     if not history:
         return ""
-    lines = []
-    for i, h in enumerate(history, 1):
-        act = h.get("action", "?")
+    return "\n".join(
+        f"Step {i}: {_cached_history_line(_qwen3vl_line_cache, h, _qwen3vl_history_line)}"
+        for i, h in enumerate(history, 1)
+    )
 
-        if act == "SYSTEM_FEEDBACK":
-            feedback = h.get("target", "")
-            lines.append(f"Step {i}: ⚠️ WARNING: {feedback}")
-            continue
 
-        # Build a short description of what was done
-        desc_parts = [act]
-        if act in ("CLICK", "DOUBLE_CLICK", "RIGHT_CLICK"):
-            hx, hy = h.get("x"), h.get("y")
-            if isinstance(hx, (int, float)) and isinstance(hy, (int, float)):
-                desc_parts.append(f"at ({hx:.4f}, {hy:.4f})")
-        elif act == "TYPE":
-            text = h.get("text", "")
-            desc_parts.append(f"'{text[:40]}'" if text else "")
-        elif act == "PRESS":
-            desc_parts.append(h.get("key", ""))
-        elif act == "HOTKEY":
-            desc_parts.append("+".join(h.get("keys") or []))
-        elif act == "SCROLL":
-            desc_parts.append(str(h.get("scroll", 0)))
-
-        target = h.get("target", h.get("why_short", ""))
-        if target:
-            if len(target) > 60:
-                target = target[:57] + "..."
-            desc_parts.append(f"— {target}")
-
-        sc = h.get("screen_changed")
-        if sc is False:
-            desc_parts.append("❌ NO EFFECT")
-        elif sc is True:
-            desc_parts.append("✓")
-
-        lines.append(f"Step {i}: {' '.join(p for p in desc_parts if p)}")
-    return "\n".join(lines)
+# Warning blocks appended after the history; {feedback} is the guard message
+_QWEN3VL_FEEDBACK_WARNING_TMPL = (
+    "\n⚠️ CRITICAL WARNING: {feedback}\n"
+    "You MUST try a COMPLETELY DIFFERENT approach. "
+    "Do NOT click the same area. Use keyboard instead:\n"
+    '- HOTKEY keys=["ctrl","l"] to focus address bar, then TYPE to enter URL\n'
+    '- HOTKEY keys=["ctrl","t"] to open new tab\n'
+    "- SCROLL to find different elements\n"
+    "- Click a DIFFERENT part of the screen"
+)
+_QWEN3VL_NO_EFFECT_WARNING = (
+    "\n⚠️ WARNING: Your last action had NO visible effect on the screen. "
+    "That click/action did NOT work. Try something DIFFERENT."
+)
 
 
 def _build_qwen3vl_instruction(objective: str, history: List[Dict[str, Any]]) -> str:
-    """Build the full user prompt for Qwen3-VL, with prominent feedback warnings."""
+    """Build the full user prompt for Qwen3-VL, with prominent feedback warnings.
+
+    History comes before the warning block so the prompt only ever grows at the
+    end — llama.cpp can then reuse the KV cache for the unchanged prefix.
+    """
     parts = [f"OBJECTIVE: {objective}"]
 
+    # Add formatted history
+    history_text = _format_qwen3vl_history(history)
+    if history_text:
+        parts.append(f"\nHISTORY:\n{history_text}")
+    else:
+        parts.append("\nHISTORY: (none)")
+
     # If the last action had no visible effect or guard sent feedback, add LOUD warning
     if history:
         last = history[-1]
@@ -194,38 +579,51 @@ def _build_qwen3vl_instruction(objective: str, history: List[Dict[str, Any]]) ->
 
         if last_action == "SYSTEM_FEEDBACK":
             feedback = last.get("target", "")
-            parts.append(
-                f"\n⚠️ CRITICAL WARNING: {feedback}\n"
-                "You MUST try a COMPLETELY DIFFERENT approach. "
-                "Do NOT click the same area. Use keyboard instead:\n"
-                '- HOTKEY keys=["ctrl","l"] to focus address bar, then TYPE to enter URL\n'
-                '- HOTKEY keys=["ctrl","t"] to open new tab\n'
-                "- SCROLL to find different elements\n"
-                "- Click a DIFFERENT part of the screen"
-            )
+            parts.append(_QWEN3VL_FEEDBACK_WARNING_TMPL.format(feedback=feedback))
         elif last.get("screen_changed") is False:
-            parts.append(
-                "\n⚠️ WARNING: Your last action had NO visible effect on the screen. "
-                "That click/action did NOT work. Try something DIFFERENT."
-            )
-
-    # Add formatted history
-    history_text = _format_qwen3vl_history(history)
-    if history_text:
-        parts.append(f"\nHISTORY:\n{history_text}")
-    else:
-        parts.append("\nHISTORY: (none)")
+            parts.append(_QWEN3VL_NO_EFFECT_WARNING)
 
     parts.append("\nDecide the NEXT action from the CURRENT screenshot. Output ONLY JSON.")
 
     return "\n".join(parts)
 
 
+# GBNF for the Qwen3-VL answer: one JSON object whose first member is a known
+# "action"; further members are free-form. Whitespace never contains a blank
+# line, so the "\n\n" stop string cannot cut an object short.
+_QWEN3VL_GRAMMAR = r"""
+root   ::= "{" ws "\"action\"" ws ":" ws action ( ws "," ws member )* ws "}"
+action ::= "\"" ( "CLICK" | "DOUBLE_CLICK" | "RIGHT_CLICK" | "TYPE" | "PRESS" | "HOTKEY" | "SCROLL" | "WAIT" | "NOOP" | "BITTI" ) "\""
+member ::= string ws ":" ws value
+value  ::= string | number | array | "true" | "false" | "null"
+array  ::= "[" ws ( value ( ws "," ws value )* )? ws "]"
+string ::= "\"" ( [^"\\\x00-\x1F] | "\\" ( ["\\/bfnrt] | "u" hex hex hex hex ) )* "\""
+hex    ::= [0-9a-fA-F]
+number ::= "-"? [0-9]+ ( "." [0-9]+ )? ( [eE] [-+]? [0-9]+ )?
+ws     ::= [ \t]* ( "\n" [ \t]* )?
+"""
+
+
+@functools.lru_cache(maxsize=1)
+def _qwen3vl_grammar() -> Any:
+    """Compiled action grammar, or None when disabled or unsupported by this build."""
+    if not cfg.JSON_GRAMMAR:
+        return None
+    try:
+        from llama_cpp import LlamaGrammar
+        return LlamaGrammar.from_string(_QWEN3VL_GRAMMAR, verbose=False)
+    except Exception:
+        log.warning("JSON grammar unavailable — falling back to unconstrained sampling", exc_info=True)
+        return None
+
+
 def _ask_qwen3vl(llm: Llama, objective: str, uri: str, history: List[Dict[str, Any]]) -> Dict[str, Any]:
     user_text = _build_qwen3vl_instruction(objective, history)
     log.debug("Qwen3-VL prompt:\n%s", user_text)
 
-    resp = llm.create_chat_completion(
+    # The answer is a single JSON object — stop decoding at its closing brace
+    raw_output, finish = _stream_completion(
+        llm, _json_object_closed(),
         messages=[
             {"role": "system", "content": _QWEN3VL_SYSTEM},
             {"role": "user", "content": [
@@ -237,8 +635,10 @@ def _ask_qwen3vl(llm: Llama, objective: str, uri: str, history: List[Dict[str, A
         top_p=0.9,
         max_tokens=220,
         stop=["\n\n", "<|im_end|>"],
+        grammar=_qwen3vl_grammar(),
     )
-    return _parse_json_obj(resp["choices"][0]["message"]["content"])
+    log.debug("Qwen3-VL raw output (%s): %.500r", finish, raw_output)
+    return _parse_json_obj(raw_output)
 
 
 # ═══════════════════════════════════════════
@@ -271,177 +671,240 @@ finished(content='xxx')
 """
 
 
+# smart_resize constants — must match the values the C++ clip model uses (tokens * 28^2)
+_SR_FACTOR = 28
+_SR_MIN_PX = cfg.IMAGE_MIN_TOKENS * _SR_FACTOR * _SR_FACTOR   # 1024*784 = 802_816
+_SR_MAX_PX = cfg.IMAGE_MAX_TOKENS * _SR_FACTOR * _SR_FACTOR   # 4096*784 = 3_211_264
+
+
+@functools.lru_cache(maxsize=16)
 def _smart_resize(height: int, width: int) -> Tuple[int, int]:
     """Compute the dimensions Qwen2.5-VL uses internally (matches C++ clip.cpp).
 
     Coordinates the model outputs are relative to these dimensions.
     Must use the SAME min/max pixels as the C++ clip model to get correct
     coordinate conversion.  We derive them from cfg.IMAGE_MIN/MAX_TOKENS.
+
+    Memoized per (height, width); the float steps are kept exactly as
+    clip.cpp does them, since integer rewrites differ at boundary sizes.
     """
-    factor = 28
-    # Must match the values the C++ clip model uses (token * 28^2)
-    min_pixels = cfg.IMAGE_MIN_TOKENS * factor * factor   # 1024*784 = 802_816
-    max_pixels = cfg.IMAGE_MAX_TOKENS * factor * factor   # 4096*784 = 3_211_264
+    factor = _SR_FACTOR
 
     h_bar = max(factor, round(height / factor) * factor)
     w_bar = max(factor, round(width / factor) * factor)
 
-    if h_bar * w_bar > max_pixels:
-        beta = math.sqrt((height * width) / max_pixels)
+    if h_bar * w_bar > _SR_MAX_PX:
+        beta = math.sqrt((height * width) / _SR_MAX_PX)
         h_bar = math.floor(height / beta / factor) * factor
         w_bar = math.floor(width / beta / factor) * factor
-    elif h_bar * w_bar < min_pixels:
-        beta = math.sqrt(min_pixels / (height * width))
+    elif h_bar * w_bar < _SR_MIN_PX:
+        beta = math.sqrt(_SR_MIN_PX / (height * width))
         h_bar = math.ceil(height * beta / factor) * factor
         w_bar = math.ceil(width * beta / factor) * factor
 
     return h_bar, w_bar
 
 
-# Regex to extract action calls like: click(start_box='(235,512)')
-_UITARS_ACTION_RE = re.compile(
-    r"Action:\s*(.+?)(?:\n|$)", re.IGNORECASE
+_last_resize_logged: Optional[Tuple[int, int]] = None
+
+
+def _log_smart_resize(img_w: int, img_h: int, smart_w: int, smart_h: int) -> None:
+    """Log the smart_resize mapping at INFO only when the screenshot size changes."""
+    global _last_resize_logged
+    level = logging.DEBUG if _last_resize_logged == (img_w, img_h) else logging.INFO
+    _last_resize_logged = (img_w, img_h)
+    log.log(level, "Image %dx%d -> smart_resize %dx%d (%d tokens)",
+            img_w, img_h, smart_w, smart_h, (smart_h // _SR_FACTOR) * (smart_w // _SR_FACTOR))
+
+
+# Whole "Thought: ...\nAction: click(start_box='(235,512)')" reply in one scan.
+# "Thought:" is case-sensitive and optional; "Action:" is case-insensitive.
+_UITARS_OUTPUT_RE = re.compile(
+    r"(?:(?-i:Thought:)\s*(?P<thought>.+?)(?=\nAction:|\n\n|$).*?)?"
+    r"Action:\s*(?P<action>[^\n]+)",
+    re.DOTALL | re.IGNORECASE,
 )
 _UITARS_COORD_RE = re.compile(
     r"\((\d+(?:\.\d+)?)\s*,\s*(\d+(?:\.\d+)?)\)"
 )
-_UITARS_THOUGHT_RE = re.compile(
-    r"Thought:\s*(.+?)(?:\nAction:|\n\n|$)", re.DOTALL
-)
+# Quoted action arguments: content='...' / key="..." etc. Group 2 is the value.
+_UITARS_CONTENT_RE = re.compile(r"""content=(['"])(.*?)\1""", re.DOTALL)
+_UITARS_KEY_RE = re.compile(r"""key=(['"])(.*?)\1""")
+_UITARS_DIRECTION_RE = re.compile(r"""direction=(['"])(.*?)\1""")
 
 
-def _parse_uitars_output(text: str, img_w: int, img_h: int) -> Dict[str, Any]:
-    """Parse UI-TARS Thought/Action output into our internal action dict."""
-    text = text.strip()
+def _uitars_type(action_str: str) -> Dict[str, Any]:
+    content_m = _UITARS_CONTENT_RE.search(action_str)
+    text_val = content_m.group(2) if content_m else ""
+    # Unescape
+    text_val = text_val.replace("\\n", "\n").replace("\\'", "'").replace('\\"', '"')
+    return {"action": "TYPE", "text": text_val}
+
+
+def _uitars_hotkey(action_str: str) -> Dict[str, Any]:
+    key_m = _UITARS_KEY_RE.search(action_str)
+    keys = (key_m.group(2) if key_m else "").split()
+    if len(keys) == 1:
+        return {"action": "PRESS", "key": keys[0]}
+    return {"action": "HOTKEY", "keys": keys}
+
+
+def _uitars_scroll(action_str: str) -> Dict[str, Any]:
+    dir_m = _UITARS_DIRECTION_RE.search(action_str)
+    direction = (dir_m.group(2) if dir_m else "down").lower()
+    return {"action": "SCROLL", "scroll": -3 if direction in ("down", "right") else 3}
+
+
+# UI-TARS click verbs -> our action names (all take start_box coordinates)
+_UITARS_CLICK_VERBS = {
+    "click": "CLICK",
+    "left_double": "DOUBLE_CLICK",
+    "right_single": "RIGHT_CLICK",
+}
+
+# Remaining UI-TARS verbs -> handler(action_str) returning the action dict
+_UITARS_HANDLERS: Dict[str, Callable[[str], Dict[str, Any]]] = {
+    "type": _uitars_type,
+    "hotkey": _uitars_hotkey,
+    "scroll": _uitars_scroll,
+    "wait": lambda _s: {"action": "WAIT", "seconds": 5.0},
+    "finished": lambda _s: {"action": "BITTI"},
+}
+
 
-    # Extract thought
-    thought_m = _UITARS_THOUGHT_RE.search(text)
-    thought = thought_m.group(1).strip() if thought_m else ""
+def _parse_uitars_output(text: str, img_w: int, img_h: int,
+                         smart_size: Optional[Tuple[int, int]] = None) -> Dict[str, Any]:
+    """Parse UI-TARS Thought/Action output into our internal action dict.
 
-    # Extract action line
-    action_m = _UITARS_ACTION_RE.search(text)
-    if not action_m:
+    smart_size is the (smart_h, smart_w) already computed by the caller; it is
+    derived from img_w/img_h when omitted.
+    """
+    text = text.strip()
+
+    m = _UITARS_OUTPUT_RE.search(text)
+    if not m:
         return {"action": "NOOP", "why_short": f"Could not parse: {text[:80]}"}
 
-    action_str = action_m.group(1).strip()
+    thought = (m.group("thought") or "").strip()
+    action_str = m.group("action").strip()
 
-    # Compute smart_resize dimensions for coordinate conversion
-    smart_h, smart_w = _smart_resize(img_h, img_w)
+    # smart_resize dimensions for coordinate conversion
+    smart_h, smart_w = smart_size or _smart_resize(img_h, img_w)
 
-    # Parse the action type and arguments
-    action_lower = action_str.lower()
+    # Dispatch on the verb before "(" — "click(start_box=...)" -> "click"
+    verb, paren, _ = action_str.lower().partition("(")
+    if not paren:
+        verb = ""
 
-    if action_lower.startswith("click("):
-        coords = _UITARS_COORD_RE.search(action_str)
+    click_action = _UITARS_CLICK_VERBS.get(verb)
+    if click_action is not None:
+        # The tuple is normally the first "(" after the call's own paren
+        start = action_str.find("(", len(verb) + 1)
+        coords = None
+        if start >= 0:
+            coords = _UITARS_COORD_RE.match(action_str, start) or _UITARS_COORD_RE.search(action_str, start)
         if coords:
             raw_x, raw_y = float(coords.group(1)), float(coords.group(2))
             x = raw_x / smart_w
             y = raw_y / smart_h
-            log.info("CLICK (%s,%s) / (%s,%s) -> norm (%.4f,%.4f)", raw_x, raw_y, smart_w, smart_h, x, y)
-            return {"action": "CLICK", "x": x, "y": y,
+            log.info("%s (%s,%s) / (%s,%s) -> norm (%.4f,%.4f)",
+                     click_action, raw_x, raw_y, smart_w, smart_h, x, y)
+            return {"action": click_action, "x": x, "y": y,
                     "target": thought, "why_short": thought}
+    else:
+        handler = _UITARS_HANDLERS.get(verb)
+        if handler is not None:
+            act = handler(action_str)
+            act["target"] = thought
+            act["why_short"] = thought
+            return act
 
-    elif action_lower.startswith("left_double("):
-        coords = _UITARS_COORD_RE.search(action_str)
-        if coords:
-            x = float(coords.group(1)) / smart_w
-            y = float(coords.group(2)) / smart_h
-            return {"action": "DOUBLE_CLICK", "x": x, "y": y,
-                    "target": thought, "why_short": thought}
+    # Fallback
+    return {"action": "NOOP", "why_short": f"Unknown UI-TARS action: {action_str[:60]}"}
 
-    elif action_lower.startswith("right_single("):
-        coords = _UITARS_COORD_RE.search(action_str)
-        if coords:
-            x = float(coords.group(1)) / smart_w
-            y = float(coords.group(2)) / smart_h
-            return {"action": "RIGHT_CLICK", "x": x, "y": y,
-                    "target": thought, "why_short": thought}
 
-    elif action_lower.startswith("type("):
-        content_m = re.search(r"content='(.*?)'", action_str, re.DOTALL)
-        if not content_m:
-            content_m = re.search(r'content="(.*?)"', action_str, re.DOTALL)
-        text_val = content_m.group(1) if content_m else ""
-        # Unescape
-        text_val = text_val.replace("\\n", "\n").replace("\\'", "'").replace('\\"', '"')
-        return {"action": "TYPE", "text": text_val,
-                "target": thought, "why_short": thought}
-
-    elif action_lower.startswith("hotkey("):
-        key_m = re.search(r"key='(.*?)'", action_str)
-        if not key_m:
-            key_m = re.search(r'key="(.*?)"', action_str)
-        keys_str = key_m.group(1) if key_m else ""
-        keys = keys_str.split()
-        if len(keys) == 1:
-            return {"action": "PRESS", "key": keys[0],
-                    "target": thought, "why_short": thought}
-        return {"action": "HOTKEY", "keys": keys,
-                "target": thought, "why_short": thought}
-
-    elif action_lower.startswith("scroll("):
-        dir_m = re.search(r"direction='(.*?)'", action_str)
-        if not dir_m:
-            dir_m = re.search(r'direction="(.*?)"', action_str)
-        direction = (dir_m.group(1) if dir_m else "down").lower()
-        scroll_val = -3 if direction in ("down", "right") else 3
-        return {"action": "SCROLL", "scroll": scroll_val,
-                "target": thought, "why_short": thought}
-
-    elif action_lower.startswith("wait("):
-        return {"action": "WAIT", "seconds": 5.0,
-                "target": thought, "why_short": thought}
-
-    elif action_lower.startswith("finished("):
-        return {"action": "BITTI",
-                "target": thought, "why_short": thought}
+# A finished "Action: ...\n" line in streamed UI-TARS output
+_UITARS_ACTION_DONE_RE = re.compile(r"Action:[ \t]*\S[^\n]*\n", re.IGNORECASE)
 
-    # Fallback
-    return {"action": "NOOP", "why_short": f"Unknown UI-TARS action: {action_str[:60]}"}
+
+def _uitars_action_done() -> Callable[[str], bool]:
+    """Incremental matcher: True once a complete Action line has been streamed."""
+    seen: List[str] = []
+
+    def feed(piece: str) -> bool:
+        seen.append(piece)
+        return "\n" in piece and _UITARS_ACTION_DONE_RE.search("".join(seen)) is not None
+
+    return feed
+
+
+_UITARS_SC_SUFFIX = {False: " ❌ FAILED (no screen change)", True: " ✓"}
+
+
+def _uitars_history_line(h: Dict[str, Any]) -> str:
+    """One history entry for UI-TARS, without the 'Step N:' prefix."""
+    act = h.get("action", "?")
+
+    if act == "SYSTEM_FEEDBACK":
+        feedback = h.get("target", "")
+        return f"⚠️ FEEDBACK: {feedback}"
+
+    # Keep target descriptions short (first sentence only)
+    target = h.get("target", h.get("why_short", ""))
+    if target and len(target) > 80:
+        # Truncate to first sentence or 80 chars
+        dot = target.find(". ")
+        if 0 < dot < 100:
+            target = target[:dot + 1]
+        else:
+            target = target[:77] + "..."
+
+    return f"{act} — {target}{_UITARS_SC_SUFFIX.get(h.get('screen_changed'), '')}"
 
 
 def _format_uitars_history(history: List[Dict[str, Any]]) -> str:
     """Convert internal history to a brief text summary for UI-TARS context.
 
     Keeps descriptions short to save tokens. Prominently marks failed actions.
+    Only entries that are new or changed since the last call are re-formatted.
     """
     if not history:
         return ""
-    lines = []
-    for i, h in enumerate(history, 1):
-        act = h.get("action", "?")
+    return "\n".join(
+        f"Step {i}: {_cached_history_line(_uitars_line_cache, h, _uitars_history_line)}"
+        for i, h in enumerate(history, 1)
+    )
 
-        if act == "SYSTEM_FEEDBACK":
-            feedback = h.get("target", "")
-            lines.append(f"Step {i}: ⚠️ FEEDBACK: {feedback}")
-            continue
 
-        # Keep target descriptions short (first sentence only)
-        target = h.get("target", h.get("why_short", ""))
-        if target and len(target) > 80:
-            # Truncate to first sentence or 80 chars
-            dot = target.find(". ")
-            if 0 < dot < 100:
-                target = target[:dot + 1]
-            else:
-                target = target[:77] + "..."
-
-        sc = h.get("screen_changed")
-        if sc is False:
-            line = f"Step {i}: {act} — {target} ❌ FAILED (no screen change)"
-        elif sc is True:
-            line = f"Step {i}: {act} — {target} ✓"
-        else:
-            line = f"Step {i}: {act} — {target}"
-        lines.append(line)
-    return "\n".join(lines)
+_UITARS_FEEDBACK_WARNING_TMPL = (
+    "\n\n⚠️ CRITICAL WARNING: {feedback}\n"
+    "You MUST try a fundamentally different approach. "
+    "Do NOT click the same area again. Consider:\n"
+    "- Using keyboard shortcuts (hotkey) instead of clicking\n"
+    "- Typing a URL directly in the address bar\n"
+    "- Scrolling to find different elements\n"
+    "- Clicking a completely different part of the screen"
+)
+_UITARS_NO_EFFECT_WARNING = (
+    "\n\n⚠️ WARNING: Your last action had NO visible effect on the screen. "
+    "The click/action did not work. Try a different element or approach."
+)
 
 
 def _build_uitars_instruction(objective: str, history: List[Dict[str, Any]]) -> str:
-    """Build the full instruction text for UI-TARS, with prominent feedback."""
+    """Build the full instruction text for UI-TARS, with prominent feedback.
+
+    The warning goes after the history so earlier prompt tokens stay stable
+    between steps (KV-cache prefix reuse).
+    """
     parts = [objective]
 
-    # If the last action had no visible effect, put a LOUD warning at the top
+    # Add condensed history
+    history_text = _format_uitars_history(history)
+    if history_text:
+        parts.append(f"\n\nPrevious actions:\n{history_text}")
+
+    # If the last action had no visible effect, put a LOUD warning at the end
     if history:
         last = history[-1]
         last_action = (last.get("action") or "").upper()
@@ -449,25 +912,9 @@ def _build_uitars_instruction(objective: str, history: List[Dict[str, Any]]) ->
         if last_action == "SYSTEM_FEEDBACK":
             # Guard feedback — make it impossible to miss
             feedback = last.get("target", "")
-            parts.append(
-                f"\n\n⚠️ CRITICAL WARNING: {feedback}\n"
-                "You MUST try a fundamentally different approach. "
-                "Do NOT click the same area again. Consider:\n"
-                "- Using keyboard shortcuts (hotkey) instead of clicking\n"
-                "- Typing a URL directly in the address bar\n"
-                "- Scrolling to find different elements\n"
-                "- Clicking a completely different part of the screen"
-            )
+            parts.append(_UITARS_FEEDBACK_WARNING_TMPL.format(feedback=feedback))
         elif last.get("screen_changed") is False:
-            parts.append(
-                "\n\n⚠️ WARNING: Your last action had NO visible effect on the screen. "
-                "The click/action did not work. Try a different element or approach."
-            )
-
-    # Add condensed history
-    history_text = _format_uitars_history(history)
-    if history_text:
-        parts.append(f"\n\nPrevious actions:\n{history_text}")
+            parts.append(_UITARS_NO_EFFECT_WARNING)
 
     return "\n".join(parts)
 
@@ -477,10 +924,11 @@ def _ask_uitars(llm: Llama, objective: str, uri: str, history: List[Dict[str, An
     instruction = _build_uitars_instruction(objective, history)
 
     smart_h, smart_w = _smart_resize(img_h, img_w)
-    log.info("Image %dx%d -> smart_resize %dx%d (%d tokens)",
-             img_w, img_h, smart_w, smart_h, (smart_h // 28) * (smart_w // 28))
+    _log_smart_resize(img_w, img_h, smart_w, smart_h)
 
-    resp = llm.create_chat_completion(
+    # Stop once the Action line is complete — anything after it is never parsed
+    raw_output, finish = _stream_completion(
+        llm, _uitars_action_done(),
         messages=[
             {"role": "user", "content": [
                 {"type": "text", "text": _UITARS_SYSTEM + instruction},
@@ -495,10 +943,8 @@ def _ask_uitars(llm: Llama, objective: str, uri: str, history: List[Dict[str, An
         max_tokens=1000,
         stop=["<|im_end|>"],
     )
-    raw_output = resp["choices"][0]["message"]["content"]
-    finish = resp["choices"][0].get("finish_reason", "?")
-    log.debug("Raw output (%s): %r", finish, raw_output)
-    return _parse_uitars_output(raw_output, img_w, img_h)
+    log.debug("Raw output (%s): %.500r", finish, raw_output)
+    return _parse_uitars_output(raw_output, img_w, img_h, (smart_h, smart_w))
 
 
 # ═══════════════════════════════════════════
@@ -518,91 +964,104 @@ _FARA_KEY_MAP: Dict[str, str] = {
     "PageUp": "pageup", "PageDown": "pagedown",
     "Control": "ctrl", "Shift": "shift", "Alt": "alt",
     "Meta": "super", "Space": "space",
-    "F1": "f1", "F2": "f2", "F3": "f3", "F4": "f4", "F5": "f5",
-    "F6": "f6", "F7": "f7", "F8": "f8", "F9": "f9", "F10": "f10",
-    "F11": "f11", "F12": "f12",
+    **{f"F{i}": f"f{i}" for i in range(1, 13)},
 }
 
 
+# Read-only lookup that also covers lowercase spellings ("escape", "arrowup"),
+# so those map to the xdotool name too instead of passing through as-is.
+_FARA_KEY_LOOKUP: Mapping[str, str] = MappingProxyType(
+    {**{k.lower(): v for k, v in _FARA_KEY_MAP.items()}, **_FARA_KEY_MAP}
+)
+
+
 def _fara_map_key(key: str) -> str:
     """Map a Fara key name to the xdotool name used by the sandbox."""
-    return _FARA_KEY_MAP.get(key, key.lower())
+    return _FARA_KEY_LOOKUP.get(key) or key.lower()
+
+
+# computer_use tool definition, serialized once; the resolution is filled in per
+# screen size by _build_fara_system_prompt.
+_FARA_TOOL_DEF_JSON = json.dumps({
+    "name": "computer_use",
+    "description": (
+        "Use a mouse and keyboard to interact with a computer, and take screenshots.\n"
+        "* This is a Linux XFCE desktop. You can see the desktop with icons and a taskbar.\n"
+        "* IMPORTANT: If no browser window is visible on screen, you MUST first open Firefox "
+        "by double-clicking its icon on the desktop or in the taskbar. Only after Firefox is "
+        "open and visible can you use visit_url or web_search actions.\n"
+        "* visit_url and web_search REQUIRE a browser to be open. They use keyboard shortcuts "
+        "(Ctrl+L) that only work inside a browser window. If no browser is visible, these "
+        "actions will fail silently. Always check the screenshot first.\n"
+        "* You do not have access to a terminal or applications menu. You must click on "
+        "desktop icons to start applications.\n"
+        "* Some applications may take time to start or process actions, so you may need to "
+        "wait and take successive screenshots to see the results of your actions. E.g. if "
+        "you click on Firefox and a window doesn't open, try wait and taking another screenshot.\n"
+        "* The screen's resolution is __SCREEN_W__x__SCREEN_H__.\n"
+        "* Whenever you intend to move the cursor to click on an element like an icon, "
+        "you should consult a screenshot to determine the coordinates of the element "
+        "before moving the cursor.\n"
+        "* If you tried clicking on a program or link but it failed to load, even after "
+        "waiting, try adjusting your cursor position so that the tip of the cursor visually "
+        "falls on the element that you want to click.\n"
+        "* Make sure to click any buttons, links, icons, etc with the cursor tip in the center "
+        "of the element. Don't click boxes on their edges unless asked.\n"
+        "* When a separate scrollable container prominently overlays the webpage, if you want "
+        "to scroll within it, you typically need to mouse_move() over it first and then scroll().\n"
+        "* If a popup window appears that you want to close, if left_click() on the 'X' or close "
+        "button doesn't work, try key(keys=['Escape']) to close it.\n"
+        "* On some search bars, when you type(), you may need to press_enter=False and instead "
+        "separately call left_click() on the search button to submit the search query.\n"
+        "* For calendar widgets, you usually need to left_click() on arrows to move between "
+        "months and left_click() on dates to select them; type() is not typically used.\n"
+        "* ALWAYS look at the screenshot carefully before choosing an action. Describe what "
+        "you see on screen in your thinking before acting."
+    ),
+    "parameters": {
+        "type": "object",
+        "properties": {
+            "action": {
+                "type": "string",
+                "enum": [
+                    "key", "type", "mouse_move", "left_click", "scroll",
+                    "visit_url", "web_search", "history_back",
+                    "pause_and_memorize_fact", "wait", "terminate",
+                ],
+            },
+            "coordinate": {
+                "type": "array",
+                "items": {"type": "integer"},
+                "description": "The x,y pixel coordinate on the screen.",
+            },
+            "keys": {
+                "type": "array",
+                "items": {"type": "string"},
+                "description": "Key names for key action.",
+            },
+            "text": {"type": "string", "description": "Text to type."},
+            "url": {"type": "string", "description": "URL for visit_url."},
+            "query": {"type": "string", "description": "Query for web_search."},
+            "pixels": {"type": "integer", "description": "Scroll amount (positive=up, negative=down)."},
+            "time": {"type": "integer", "description": "Wait duration in seconds."},
+            "status": {"type": "string", "description": "Termination status (success/failure)."},
+            "fact": {"type": "string", "description": "Fact to memorize."},
+        },
+        "required": ["action"],
+    },
+}, indent=2)
 
 
+@functools.lru_cache(maxsize=4)
 def _build_fara_system_prompt(screen_w: int, screen_h: int) -> str:
     """Build the Fara-7B system prompt with dynamic screen resolution.
 
     Follows the exact format from Microsoft's fara/_prompts.py: a description of
     the computer_use tool with the <tools> block, plus the fn_call template.
     """
-    tool_def = json.dumps({
-        "name": "computer_use",
-        "description": (
-            "Use a mouse and keyboard to interact with a computer, and take screenshots.\n"
-            "* This is a Linux XFCE desktop. You can see the desktop with icons and a taskbar.\n"
-            "* IMPORTANT: If no browser window is visible on screen, you MUST first open Firefox "
-            "by double-clicking its icon on the desktop or in the taskbar. Only after Firefox is "
-            "open and visible can you use visit_url or web_search actions.\n"
-            "* visit_url and web_search REQUIRE a browser to be open. They use keyboard shortcuts "
-            "(Ctrl+L) that only work inside a browser window. If no browser is visible, these "
-            "actions will fail silently. Always check the screenshot first.\n"
-            "* You do not have access to a terminal or applications menu. You must click on "
-            "desktop icons to start applications.\n"
-            "* Some applications may take time to start or process actions, so you may need to "
-            "wait and take successive screenshots to see the results of your actions. E.g. if "
-            "you click on Firefox and a window doesn't open, try wait and taking another screenshot.\n"
-            f"* The screen's resolution is {screen_w}x{screen_h}.\n"
-            "* Whenever you intend to move the cursor to click on an element like an icon, "
-            "you should consult a screenshot to determine the coordinates of the element "
-            "before moving the cursor.\n"
-            "* If you tried clicking on a program or link but it failed to load, even after "
-            "waiting, try adjusting your cursor position so that the tip of the cursor visually "
-            "falls on the element that you want to click.\n"
-            "* Make sure to click any buttons, links, icons, etc with the cursor tip in the center "
-            "of the element. Don't click boxes on their edges unless asked.\n"
-            "* When a separate scrollable container prominently overlays the webpage, if you want "
-            "to scroll within it, you typically need to mouse_move() over it first and then scroll().\n"
-            "* If a popup window appears that you want to close, if left_click() on the 'X' or close "
-            "button doesn't work, try key(keys=['Escape']) to close it.\n"
-            "* On some search bars, when you type(), you may need to press_enter=False and instead "
-            "separately call left_click() on the search button to submit the search query.\n"
-            "* For calendar widgets, you usually need to left_click() on arrows to move between "
-            "months and left_click() on dates to select them; type() is not typically used.\n"
-            "* ALWAYS look at the screenshot carefully before choosing an action. Describe what "
-            "you see on screen in your thinking before acting."
-        ),
-        "parameters": {
-            "type": "object",
-            "properties": {
-                "action": {
-                    "type": "string",
-                    "enum": [
-                        "key", "type", "mouse_move", "left_click", "scroll",
-                        "visit_url", "web_search", "history_back",
-                        "pause_and_memorize_fact", "wait", "terminate",
-                    ],
-                },
-                "coordinate": {
-                    "type": "array",
-                    "items": {"type": "integer"},
-                    "description": "The x,y pixel coordinate on the screen.",
-                },
-                "keys": {
-                    "type": "array",
-                    "items": {"type": "string"},
-                    "description": "Key names for key action.",
-                },
-                "text": {"type": "string", "description": "Text to type."},
-                "url": {"type": "string", "description": "URL for visit_url."},
-                "query": {"type": "string", "description": "Query for web_search."},
-                "pixels": {"type": "integer", "description": "Scroll amount (positive=up, negative=down)."},
-                "time": {"type": "integer", "description": "Wait duration in seconds."},
-                "status": {"type": "string", "description": "Termination status (success/failure)."},
-                "fact": {"type": "string", "description": "Fact to memorize."},
-            },
-            "required": ["action"],
-        },
-    }, indent=2)
+    tool_def = (_FARA_TOOL_DEF_JSON
+                .replace("__SCREEN_W__", str(screen_w))
+                .replace("__SCREEN_H__", str(screen_h)))
 
     return (
         "You are a helpful assistant.\n\n"
@@ -618,171 +1077,223 @@ def _build_fara_system_prompt(screen_w: int, screen_h: int) -> str:
     )
 
 
-def _parse_fara_output(text: str, img_w: int, img_h: int) -> Dict[str, Any]:
-    """Parse Fara-7B <tool_call> output into CuaOS internal action dict."""
-    text = text.strip()
+def _fara_norm_coord(coord: Any, smart_w: int, smart_h: int) -> Optional[Tuple[float, float]]:
+    """Pixel coords in smart_resize space -> normalized 0-1, or None if malformed."""
+    if isinstance(coord, (list, tuple)) and len(coord) >= 2:
+        return float(coord[0]) * (1.0 / smart_w), float(coord[1]) * (1.0 / smart_h)
+    return None
 
-    # Extract thought (everything before <tool_call>)
-    parts = text.split("<tool_call>")
-    thought = parts[0].strip() if len(parts) > 1 else ""
 
-    # Extract JSON from between <tool_call> and </tool_call>
-    tc_match = re.search(r"<tool_call>\s*\n?(.*?)\s*\n?</tool_call>", text, re.DOTALL)
-    if not tc_match:
-        # Try without closing tag (model may have been cut off)
-        tc_match = re.search(r"<tool_call>\s*\n?(.*)", text, re.DOTALL)
-        if not tc_match:
-            return {"action": "NOOP", "why_short": f"No <tool_call> found: {text[:80]}"}
+def _load_tool_call(action_text: str) -> Any:
+    """Decode a tool_call body that is either JSON or a Python-style dict literal.
 
-    action_text = tc_match.group(1).strip()
+    When the first quote is a single quote the JSON attempt is skipped — it
+    would only raise — and ast.literal_eval goes first.
+    """
+    sq, dq = action_text.find("'"), action_text.find('"')
+    if sq >= 0 and (dq < 0 or sq < dq):
+        try:
+            return ast.literal_eval(action_text)
+        except (ValueError, SyntaxError):
+            pass
     try:
-        action = json.loads(action_text)
+        return _json_loads(action_text)
     except json.JSONDecodeError:
-        try:
-            import ast
-            action = ast.literal_eval(action_text)
-        except Exception:
-            return {"action": "NOOP", "why_short": f"Invalid JSON in tool_call: {action_text[:80]}"}
+        return ast.literal_eval(action_text)
 
-    args = action.get("arguments", {})
-    fara_action = args.get("action", "")
 
-    # Compute smart_resize dimensions for coordinate conversion
-    smart_h, smart_w = _smart_resize(img_h, img_w)
+# Fara action handlers: (args, thought, smart_w, smart_h) -> action dict, or
+# None when the arguments are unusable (reported as an unknown action).
 
-    # Helper to normalize pixel coords from smart_resize space to 0-1
-    def _norm_coord(coord):
-        if isinstance(coord, (list, tuple)) and len(coord) >= 2:
-            x = float(coord[0]) / smart_w
-            y = float(coord[1]) / smart_h
-            return x, y
+def _fara_left_click(args: Dict[str, Any], thought: str, smart_w: int, smart_h: int) -> Optional[Dict[str, Any]]:
+    coords = _fara_norm_coord(args.get("coordinate"), smart_w, smart_h)
+    if not coords:
         return None
+    log.info("FARA CLICK %s / (%s,%s) -> norm (%.4f,%.4f)",
+             args["coordinate"], smart_w, smart_h, coords[0], coords[1])
+    return {"action": "CLICK", "x": coords[0], "y": coords[1],
+            "target": thought, "why_short": thought[:80]}
 
-    if fara_action == "left_click":
-        coords = _norm_coord(args.get("coordinate"))
-        if coords:
-            log.info("FARA CLICK %s / (%s,%s) -> norm (%.4f,%.4f)",
-                     args["coordinate"], smart_w, smart_h, coords[0], coords[1])
-            return {"action": "CLICK", "x": coords[0], "y": coords[1],
-                    "target": thought, "why_short": thought[:80]}
 
-    elif fara_action == "mouse_move":
-        coords = _norm_coord(args.get("coordinate"))
-        if coords:
-            return {"action": "MOVE", "x": coords[0], "y": coords[1],
-                    "target": thought, "why_short": thought[:80]}
-
-    elif fara_action == "type":
-        text_val = str(args.get("text", ""))
-        result = {"action": "TYPE", "text": text_val,
-                  "target": thought, "why_short": thought[:80]}
-        # If coordinate provided, click there first (handled as compound in actions.py)
-        coords = _norm_coord(args.get("coordinate"))
-        if coords:
-            result["click_x"] = coords[0]
-            result["click_y"] = coords[1]
-        result["press_enter"] = args.get("press_enter", True)
-        result["delete_existing"] = args.get("delete_existing_text", False)
-        return result
-
-    elif fara_action == "key":
-        keys_raw = args.get("keys", [])
-        keys = [_fara_map_key(k) for k in keys_raw]
-        if len(keys) == 1:
-            return {"action": "PRESS", "key": keys[0],
-                    "target": thought, "why_short": thought[:80]}
-        return {"action": "HOTKEY", "keys": keys,
-                "target": thought, "why_short": thought[:80]}
+def _fara_mouse_move(args: Dict[str, Any], thought: str, smart_w: int, smart_h: int) -> Optional[Dict[str, Any]]:
+    coords = _fara_norm_coord(args.get("coordinate"), smart_w, smart_h)
+    if not coords:
+        return None
+    return {"action": "MOVE", "x": coords[0], "y": coords[1],
+            "target": thought, "why_short": thought[:80]}
+
+
+def _fara_type(args: Dict[str, Any], thought: str, smart_w: int, smart_h: int) -> Dict[str, Any]:
+    text_val = str(args.get("text", ""))
+    result = {"action": "TYPE", "text": text_val,
+              "target": thought, "why_short": thought[:80]}
+    # If coordinate provided, click there first (handled as compound in actions.py)
+    coords = _fara_norm_coord(args.get("coordinate"), smart_w, smart_h)
+    if coords:
+        result["click_x"] = coords[0]
+        result["click_y"] = coords[1]
+    result["press_enter"] = args.get("press_enter", True)
+    result["delete_existing"] = args.get("delete_existing_text", False)
+    return result
+
 
-    elif fara_action == "scroll":
-        pixels = int(args.get("pixels", 0))
-        # Fara: positive=up, negative=down. CuaOS: positive=up, negative=down. Same!
-        scroll_val = 3 if pixels > 0 else -3
-        return {"action": "SCROLL", "scroll": scroll_val,
+def _fara_key(args: Dict[str, Any], thought: str, smart_w: int, smart_h: int) -> Dict[str, Any]:
+    keys = [_fara_map_key(k) for k in args.get("keys", [])]
+    if len(keys) == 1:
+        return {"action": "PRESS", "key": keys[0],
                 "target": thought, "why_short": thought[:80]}
+    return {"action": "HOTKEY", "keys": keys,
+            "target": thought, "why_short": thought[:80]}
 
-    elif fara_action == "visit_url":
-        url = str(args.get("url", ""))
-        return {"action": "VISIT_URL", "url": url,
-                "target": thought, "why_short": f"visit {url[:60]}"}
 
-    elif fara_action == "web_search":
-        query = str(args.get("query", ""))
-        return {"action": "WEB_SEARCH", "query": query,
-                "target": thought, "why_short": f"search: {query[:60]}"}
+def _fara_scroll(args: Dict[str, Any], thought: str, smart_w: int, smart_h: int) -> Dict[str, Any]:
+    pixels = int(args.get("pixels", 0))
+    # Fara: positive=up, negative=down. CuaOS: positive=up, negative=down. Same!
+    scroll_val = 3 if pixels > 0 else -3
+    return {"action": "SCROLL", "scroll": scroll_val,
+            "target": thought, "why_short": thought[:80]}
 
-    elif fara_action == "history_back":
-        return {"action": "HOTKEY", "keys": ["alt", "left"],
-                "target": thought, "why_short": "browser back"}
 
-    elif fara_action == "wait":
-        secs = float(args.get("time", 3))
-        return {"action": "WAIT", "seconds": secs,
-                "target": thought, "why_short": thought[:80]}
+def _fara_visit_url(args: Dict[str, Any], thought: str, smart_w: int, smart_h: int) -> Dict[str, Any]:
+    url = str(args.get("url", ""))
+    return {"action": "VISIT_URL", "url": url,
+            "target": thought, "why_short": f"visit {url[:60]}"}
+
+
+def _fara_web_search(args: Dict[str, Any], thought: str, smart_w: int, smart_h: int) -> Dict[str, Any]:
+    query = str(args.get("query", ""))
+    return {"action": "WEB_SEARCH", "query": query,
+            "target": thought, "why_short": f"search: {query[:60]}"}
+
+
+def _fara_history_back(args: Dict[str, Any], thought: str, smart_w: int, smart_h: int) -> Dict[str, Any]:
+    return {"action": "HOTKEY", "keys": ["alt", "left"],
+            "target": thought, "why_short": "browser back"}
+
+
+def _fara_wait(args: Dict[str, Any], thought: str, smart_w: int, smart_h: int) -> Dict[str, Any]:
+    secs = float(args.get("time", 3))
+    return {"action": "WAIT", "seconds": secs,
+            "target": thought, "why_short": thought[:80]}
+
+
+def _fara_terminate(args: Dict[str, Any], thought: str, smart_w: int, smart_h: int) -> Dict[str, Any]:
+    status = args.get("status", "success")
+    return {"action": "BITTI",
+            "target": f"{status}: {thought}", "why_short": thought[:80]}
+
+
+def _fara_memorize(args: Dict[str, Any], thought: str, smart_w: int, smart_h: int) -> Dict[str, Any]:
+    fact = str(args.get("fact", ""))
+    log.info("Fara memorized fact: %s", fact)
+    return {"action": "NOOP", "target": f"memorized: {fact}",
+            "why_short": f"memo: {fact[:60]}"}
+
+
+# Fara computer_use action name -> handler
+_FARA_HANDLERS: Dict[str, Callable[[Dict[str, Any], str, int, int], Optional[Dict[str, Any]]]] = {
+    "left_click": _fara_left_click,
+    "mouse_move": _fara_mouse_move,
+    "type": _fara_type,
+    "key": _fara_key,
+    "scroll": _fara_scroll,
+    "visit_url": _fara_visit_url,
+    "web_search": _fara_web_search,
+    "history_back": _fara_history_back,
+    "wait": _fara_wait,
+    "terminate": _fara_terminate,
+    "pause_and_memorize_fact": _fara_memorize,
+}
+
+
+def _parse_fara_output(text: str, img_w: int, img_h: int) -> Dict[str, Any]:
+    """Parse Fara-7B <tool_call> output into CuaOS internal action dict."""
+    text = text.strip()
 
-    elif fara_action == "terminate":
-        status = args.get("status", "success")
-        return {"action": "BITTI",
-                "target": f"{status}: {thought}", "why_short": thought[:80]}
+    # Thought is everything before <tool_call>; a plain substring search
+    # rejects tag-less output without starting the regex engine.
+    thought, tag, rest = text.partition("<tool_call>")
+    if not tag:
+        return {"action": "NOOP", "why_short": f"No <tool_call> found: {text[:80]}"}
+    thought = thought.strip()
 
-    elif fara_action == "pause_and_memorize_fact":
-        fact = str(args.get("fact", ""))
-        log.info("Fara memorized fact: %s", fact)
-        return {"action": "NOOP", "target": f"memorized: {fact}",
-                "why_short": f"memo: {fact[:60]}"}
+    # JSON sits between <tool_call> and </tool_call>; the closing tag may be
+    # missing when the model was cut off, then the rest of the text is used.
+    action_text = rest.partition("</tool_call>")[0].strip()
+    try:
+        action = _load_tool_call(action_text)
+    except Exception:
+        return {"action": "NOOP", "why_short": f"Invalid JSON in tool_call: {action_text[:80]}"}
+
+    args = action.get("arguments", {})
+    fara_action = args.get("action", "")
+
+    # Non-string names (unhashable lists etc.) fall through to "unknown"
+    handler = _FARA_HANDLERS.get(fara_action) if isinstance(fara_action, str) else None
+    if handler is not None:
+        # smart_resize dimensions for coordinate conversion
+        smart_h, smart_w = _smart_resize(img_h, img_w)
+        act = handler(args, thought, smart_w, smart_h)
+        if act is not None:
+            return act
 
     return {"action": "NOOP", "why_short": f"Unknown Fara action: {fara_action}"}
 
 
 # Persistent multi-turn history for Fara (kept across calls within one run)
-_fara_chat_history: List[Dict[str, Any]] = []
 _FARA_MAX_SCREENSHOTS = 3
+# user+assistant messages kept across turns; the oldest turn is dropped as a
+# whole pair in O(1) so history always starts with a user message.
+# Every follow-up user message repeats the task, so dropping the first is safe.
+_FARA_MAX_MESSAGES = 32
+_fara_chat_history: Deque[Dict[str, Any]] = deque()
+# User messages in _fara_chat_history that still carry their screenshot, oldest first
+_fara_image_msgs: Deque[Dict[str, Any]] = deque()
 
 
 def reset_fara_history() -> None:
     """Reset Fara multi-turn history (call at start of each new task run)."""
     _fara_chat_history.clear()
+    _fara_image_msgs.clear()
 
 
-def _strip_old_images(messages: List[Dict[str, Any]], keep_last: int = _FARA_MAX_SCREENSHOTS) -> List[Dict[str, Any]]:
-    """Return a copy of messages with images removed from all but the last N user messages."""
-    # Find indices of user messages that contain images
-    img_indices = []
-    for i, msg in enumerate(messages):
-        if msg.get("role") == "user":
-            content = msg.get("content")
-            if isinstance(content, list):
-                for part in content:
-                    if isinstance(part, dict) and part.get("type") == "image_url":
-                        img_indices.append(i)
-                        break
-
-    # Keep only the last N images
-    to_strip = img_indices[:-keep_last] if len(img_indices) > keep_last else []
-
-    result = []
-    for i, msg in enumerate(messages):
-        if i in to_strip:
-            # Remove image parts, keep text
-            content = msg.get("content", [])
-            if isinstance(content, list):
-                text_parts = [p for p in content if not (isinstance(p, dict) and p.get("type") == "image_url")]
-                if text_parts:
-                    result.append({"role": msg["role"], "content": text_parts})
-                # Skip entirely if only had an image
-            else:
-                result.append(msg)
-        else:
-            result.append(msg)
-    return result
+def _without_images(content: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Content parts minus image_url parts (parts are always OpenAI-style dicts)."""
+    return [p for p in content if p.get("type") != "image_url"]
+
+
+_TOOL_CALL_END = "</tool_call>"
+
+
+def _tool_call_closed() -> Callable[[str], bool]:
+    """Incremental matcher: True once the closing </tool_call> tag has been streamed."""
+    tail = ""
+
+    def feed(piece: str) -> bool:
+        nonlocal tail
+        # Keep just enough of the previous text to catch a tag split across pieces
+        tail = tail[-(len(_TOOL_CALL_END) - 1):] + piece
+        return _TOOL_CALL_END in tail
+
+    return feed
+
+
+_FARA_NO_EFFECT_OBS = (
+    "Your last action had NO visible effect on the screen. "
+    "The action did not work. You need to try a different approach.\n"
+)
+_FARA_NO_BROWSER_OBS = (
+    "REASON: visit_url/web_search failed because no browser window is active. "
+    "You MUST open Firefox first by clicking its icon on the desktop or taskbar.\n"
+)
+_FARA_CHANGED_OBS = "The screen has changed after your last action. Good progress.\n"
 
 
 def _ask_fara(llm: Llama, objective: str, uri: str, history: List[Dict[str, Any]],
               img_w: int, img_h: int) -> Dict[str, Any]:
     """Call Fara-7B with multi-turn conversation history."""
     smart_h, smart_w = _smart_resize(img_h, img_w)
-    log.info("Image %dx%d -> smart_resize %dx%d (%d tokens)",
-             img_w, img_h, smart_w, smart_h, (smart_h // 28) * (smart_w // 28))
+    _log_smart_resize(img_w, img_h, smart_w, smart_h)
 
     # Build system prompt with current screenshot's smart_resize dimensions
     system_prompt = _build_fara_system_prompt(smart_w, smart_h)
@@ -797,52 +1308,58 @@ def _ask_fara(llm: Llama, objective: str, uri: str, history: List[Dict[str, Any]
             "web navigation, you must first open Firefox by clicking its icon."
         )
     else:
-        # Build observation text from last action result
-        obs_parts = []
+        # Observation about the last action result (each line ends in "\n")
+        obs = ""
         if history:
             last = history[-1]
             last_action = (last.get("action") or "").upper()
             if last_action == "SYSTEM_FEEDBACK":
-                obs_parts.append(f"IMPORTANT WARNING: {last.get('target', '')}")
+                obs = f"IMPORTANT WARNING: {last.get('target', '')}\n"
             elif last.get("screen_changed") is False:
-                obs_parts.append(
-                    "Your last action had NO visible effect on the screen. "
-                    "The action did not work. You need to try a different approach."
-                )
+                obs = _FARA_NO_EFFECT_OBS
                 # Give specific guidance for common failures
                 if last_action in ("VISIT_URL", "WEB_SEARCH"):
-                    obs_parts.append(
-                        "REASON: visit_url/web_search failed because no browser window is active. "
-                        "You MUST open Firefox first by clicking its icon on the desktop or taskbar."
-                    )
+                    obs += _FARA_NO_BROWSER_OBS
             elif last.get("screen_changed") is True:
-                obs_parts.append("The screen has changed after your last action. Good progress.")
-        obs_parts.append(f"Reminder — your task: {objective}")
-        obs_parts.append("Look at the screenshot and think about what to do next.")
-        user_text = "\n".join(obs_parts)
+                obs = _FARA_CHANGED_OBS
+        user_text = (
+            f"{obs}Reminder — your task: {objective}\n"
+            "Look at the screenshot and think about what to do next."
+        )
 
     user_msg = {"role": "user", "content": [
         {"type": "image_url", "image_url": {"url": uri}},
         {"type": "text", "text": user_text},
     ]}
+    # Make room for this turn's user+assistant pair by dropping whole turns:
+    # the oldest user message plus any replies up to the next user message
+    while len(_fara_chat_history) >= _FARA_MAX_MESSAGES:
+        _fara_chat_history.popleft()
+        while _fara_chat_history and _fara_chat_history[0]["role"] != "user":
+            _fara_chat_history.popleft()
     _fara_chat_history.append(user_msg)
+    _fara_image_msgs.append(user_msg)
 
-    # Strip old images and prepend system message
-    convo = _strip_old_images(_fara_chat_history, _FARA_MAX_SCREENSHOTS)
-    messages = [{"role": "system", "content": system_prompt}] + convo
+    # Drop the image from messages that fall out of the keep-last window —
+    # once, in place, so older turns stay identical from then on
+    while len(_fara_image_msgs) > _FARA_MAX_SCREENSHOTS:
+        old = _fara_image_msgs.popleft()
+        old["content"] = _without_images(old["content"])
+
+    messages = [{"role": "system", "content": system_prompt}, *_fara_chat_history]
 
     log.debug("Fara conversation: %d messages (%d in history)",
               len(messages), len(_fara_chat_history))
 
-    resp = llm.create_chat_completion(
+    # Nothing after </tool_call> is parsed — stop decoding there
+    raw_output, finish = _stream_completion(
+        llm, _tool_call_closed(),
         messages=messages,
         temperature=0.0,
         max_tokens=1024,
         stop=["<|im_end|>"],
     )
-    raw_output = resp["choices"][0]["message"]["content"]
-    finish = resp["choices"][0].get("finish_reason", "?")
-    log.debug("Fara raw output (%s): %r", finish, raw_output)
+    log.debug("Fara raw output (%s): %.500r", finish, raw_output)
 
     # Add assistant response to history
     _fara_chat_history.append({"role": "assistant", "content": raw_output})
@@ -854,24 +1371,50 @@ def _ask_fara(llm: Llama, objective: str, uri: str, history: List[Dict[str, Any]
 # Unified entry point
 # ═══════════════════════════════════════════
 
+_resize_savings_logged = False
+
+
+def _log_resize_savings(img_w: int, img_h: int, smart_w: int, smart_h: int,
+                        full_len: int, small_len: int) -> None:
+    """Log the data-URI size reduction from pre-resizing, once per process."""
+    global _resize_savings_logged
+    if _resize_savings_logged:
+        return
+    _resize_savings_logged = True
+    log.info("Pre-resizing screenshots %dx%d -> %dx%d: data URI %d KB -> %d KB",
+             img_w, img_h, smart_w, smart_h, full_len >> 10, small_len >> 10)
+
+
+def _presize_for_qwen25vl(path: str, uri: str, img_w: int, img_h: int) -> Tuple[str, int, int]:
+    """Hand a Qwen2.5-VL-based model (UI-TARS, Fara) its smart_resize image directly.
+
+    When the target is smaller than the screenshot, the image is re-encoded at
+    exactly smart_w x smart_h, so the model sees those pixels and coordinate
+    conversion becomes 1:1. Returns (uri, width, height) to send.
+    """
+    smart_h, smart_w = _smart_resize(img_h, img_w)
+    if smart_w * smart_h >= img_w * img_h:
+        return uri, img_w, img_h
+    small_uri = resized_image_data_uri(path, smart_w, smart_h)
+    _log_resize_savings(img_w, img_h, smart_w, smart_h, len(uri), len(small_uri))
+    return small_uri, smart_w, smart_h
+
+
 def ask_next_action(llm: Llama, objective: str, screenshot_path: str, history: List[Dict[str, Any]]) -> Dict[str, Any]:
     """
     Returns one action dict. When done: {"action":"BITTI", ...}
     Dispatches to the correct prompt/parser based on cfg.CHAT_HANDLER.
     """
-    uri = image_to_data_uri(screenshot_path)
+    # One file read gives both the data URI and the dimensions
+    uri, img_w, img_h = image_payload(screenshot_path)
 
     if cfg.CHAT_HANDLER == "fara":
-        from PIL import Image
-        with Image.open(screenshot_path) as img:
-            img_w, img_h = img.size
+        uri, img_w, img_h = _presize_for_qwen25vl(screenshot_path, uri, img_w, img_h)
         return _ask_fara(llm, objective, uri, history, img_w, img_h)
 
     if cfg.CHAT_HANDLER == "qwen25vl":
         # UI-TARS — needs image dimensions for coordinate conversion
-        from PIL import Image
-        with Image.open(screenshot_path) as img:
-            img_w, img_h = img.size
+        uri, img_w, img_h = _presize_for_qwen25vl(screenshot_path, uri, img_w, img_h)
         return _ask_uitars(llm, objective, uri, history, img_w, img_h)
 
     # Default: Qwen3-VL with JSON output
@@ -1,10 +1,12 @@
 # log.py — Centralized logging for CuaOS
 from __future__ import annotations
 
+import atexit
 import logging
 import os
+import queue
 import sys
-from logging.handlers import RotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 
 _LOG_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "logs")
 os.makedirs(_LOG_DIR, exist_ok=True)
@@ -28,13 +30,19 @@ def _setup_root() -> None:
                              encoding="utf-8")
     fh.setLevel(logging.DEBUG)
     fh.setFormatter(logging.Formatter(_FORMAT, datefmt=_DATE_FMT))
-    root.addHandler(fh)
 
     # Console handler — INFO and above
     ch = logging.StreamHandler(sys.stdout)
     ch.setLevel(logging.INFO)
     ch.setFormatter(logging.Formatter(_FORMAT, datefmt=_DATE_FMT))
-    root.addHandler(ch)
+
+    # Callers only enqueue; file and console I/O happen on the listener thread,
+    # so debug dumps of model output never block the agent loop.
+    q: queue.SimpleQueue = queue.SimpleQueue()
+    root.addHandler(QueueHandler(q))
+    listener = QueueListener(q, fh, ch, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)  # flush pending records on exit
 
 
 _setup_root()
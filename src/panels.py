@@ -6,14 +6,15 @@ from __future__ import annotations
 
 import json
 import time
+from collections import deque
 from datetime import datetime
-from typing import List, Dict, Any, Optional
+from typing import Deque, List, Dict, Any, Optional
 
-from PyQt6.QtCore import Qt, pyqtSignal
-from PyQt6.QtGui import QFont
+from PyQt6.QtCore import Qt, QTimer, pyqtSignal
+from PyQt6.QtGui import QFont, QTextCursor
 from PyQt6.QtWidgets import (
     QWidget, QLabel, QFrame, QVBoxLayout, QHBoxLayout,
-    QPushButton, QLineEdit, QTextEdit, QListWidget, QListWidgetItem,
+    QPushButton, QLineEdit, QTextEdit, QListView, QListWidget, QListWidgetItem,
     QGridLayout, QSizePolicy, QFileDialog, QComboBox
 )
 
@@ -192,6 +193,10 @@ class CommandPanel(QFrame):
 
         self.steps_list = QListWidget()
         self.steps_list.setAlternatingRowColors(False)
+        # Single-line rows: skip per-item size hints and lay out in batches
+        self.steps_list.setUniformItemSizes(True)
+        self.steps_list.setLayoutMode(QListView.LayoutMode.Batched)
+        self.steps_list.setBatchSize(64)
         layout.addWidget(self.steps_list, stretch=1)
 
     def _emit_run(self) -> None:
@@ -245,6 +250,7 @@ class InspectorPanel(QFrame):
         self.action_display.setMaximumHeight(140)
         self.action_display.setPlaceholderText("No action yet…")
         layout.addWidget(self.action_display)
+        self._last_action_txt = ""
 
         # --- Metrics ---
         lbl2 = QLabel("METRICS")
@@ -299,6 +305,10 @@ class InspectorPanel(QFrame):
 
     def set_last_action(self, action_dict: Dict[str, Any]) -> None:
         txt = json.dumps(action_dict, indent=2, ensure_ascii=False)
+        # setPlainText relayouts the whole document; skip it on identical retries
+        if txt == self._last_action_txt:
+            return
+        self._last_action_txt = txt
         self.action_display.setPlainText(txt)
 
     def set_metrics(self, steps: int = 0, clicks: int = 0, types: int = 0, elapsed: float = 0) -> None:
@@ -326,6 +336,15 @@ class InspectorPanel(QFrame):
 # LOG PANEL (Bottom)
 # ═══════════════════════════════════════════
 
+# Log view: lines arriving within one interval are rendered together
+_LOG_FLUSH_MS = 50
+_LOG_MAX_ENTRIES = 10_000
+_LOG_LEVEL_COLORS = {
+    "info": C.TEXT_DIM, "warn": C.ORANGE, "error": C.RED,
+    "success": C.GREEN, "model": C.PRIMARY_LIGHT,
+}
+
+
 class LogPanel(QFrame):
     """Structured logs, error filter, export."""
 
@@ -335,7 +354,14 @@ class LogPanel(QFrame):
         self.setMinimumHeight(150)
         self.setMaximumHeight(280)
 
-        self._entries: List[Dict[str, str]] = []
+        self._entries: Deque[Dict[str, str]] = deque(maxlen=_LOG_MAX_ENTRIES)
+
+        # Lines queued since the last flush; written to the view in one edit block
+        self._pending: List[str] = []
+        self._flush_timer = QTimer(self)
+        self._flush_timer.setSingleShot(True)
+        self._flush_timer.setInterval(_LOG_FLUSH_MS)
+        self._flush_timer.timeout.connect(self._flush)
 
         layout = QVBoxLayout(self)
         layout.setContentsMargins(12, 8, 12, 8)
@@ -362,18 +388,40 @@ class LogPanel(QFrame):
         self.log_box = QTextEdit()
         self.log_box.setObjectName("logBox")
         self.log_box.setReadOnly(True)
+        self.log_box.document().setMaximumBlockCount(_LOG_MAX_ENTRIES)
         layout.addWidget(self.log_box)
 
     def append(self, msg: str, level: str = "info") -> None:
         ts = datetime.now().strftime("%H:%M:%S")
-        color_map = {"info": C.TEXT_DIM, "warn": C.ORANGE, "error": C.RED, "success": C.GREEN, "model": C.PRIMARY_LIGHT}
-        color = color_map.get(level, C.TEXT_DIM)
-        self.log_box.append(f'<span style="color:{C.TEXT_MUTED}">[{ts}]</span> <span style="color:{color}">{msg}</span>')
+        color = _LOG_LEVEL_COLORS.get(level, C.TEXT_DIM)
+        self._pending.append(f'<span style="color:{C.TEXT_MUTED}">[{ts}]</span> <span style="color:{color}">{msg}</span>')
         self._entries.append({"ts": ts, "level": level, "msg": msg})
+        if not self._flush_timer.isActive():
+            self._flush_timer.start()
+
+    def _flush(self) -> None:
+        """Write queued lines in one edit block and scroll once.
+
+        Each line gets its own text block so the document's maximum block
+        count caps log entries, matching _entries.
+        """
+        if not self._pending:
+            return
+        doc = self.log_box.document()
+        cursor = QTextCursor(doc)
+        cursor.movePosition(QTextCursor.MoveOperation.End)
+        cursor.beginEditBlock()
+        for i, line in enumerate(self._pending):
+            if i or not doc.isEmpty():
+                cursor.insertBlock()
+            cursor.insertHtml(line)
+        cursor.endEditBlock()
+        self._pending.clear()
         sb = self.log_box.verticalScrollBar()
         sb.setValue(sb.maximum())
 
     def clear(self) -> None:
+        self._pending.clear()
         self.log_box.clear()
         self._entries.clear()
 
@@ -381,5 +429,5 @@ class LogPanel(QFrame):
         path, _ = QFileDialog.getSaveFileName(self, "Export Logs", "cua_logs.json", "JSON (*.json)")
         if path:
             with open(path, "w", encoding="utf-8") as f:
-                json.dump(self._entries, f, ensure_ascii=False, indent=2)
+                json.dump(list(self._entries), f, ensure_ascii=False, indent=2)
             self.append(f"Logs exported: {path}", "success")
@@ -89,8 +89,13 @@ def generate_plan(planner: OpenRouter, objective: str) -> List[str]:
     raw_plan = resp.message.content.strip()
 
     # Parse comma-separated steps
-    steps = [s.strip() for s in raw_plan.split(",") if s.strip()]
-    return steps
+    return [s for s in map(str.strip, raw_plan.split(",")) if s]
+
+
+# Known step verbs as a plain prefix match (same as the old startswith loop)
+_STEP_VERB_RE = re.compile(
+    r"(double_click|right_click|click|type|press|hotkey|scroll|wait)(.*)", re.DOTALL
+)
 
 
 def parse_plan_step(step: str) -> dict:
@@ -106,12 +111,9 @@ def parse_plan_step(step: str) -> dict:
     """
     step = step.strip().lower()
 
-    verbs = ["double_click", "right_click", "click", "type", "press", "hotkey", "scroll", "wait"]
-
-    for verb in verbs:
-        if step.startswith(verb):
-            target = step[len(verb):].strip()
-            return {"verb": verb, "target": target}
+    m = _STEP_VERB_RE.match(step)
+    if m:
+        return {"verb": m.group(1), "target": m.group(2).strip()}
 
     # Fallback: treat entire step as a custom instruction
     return {"verb": "custom", "target": step}
@@ -5,99 +5,229 @@ import os
 import subprocess
 import time
 from io import BytesIO
-from typing import Any, Dict, Optional, Tuple
+from typing import Any, Dict, Iterator, Optional, Tuple
 
 import requests
+from requests.adapters import HTTPAdapter
 from PIL import Image
 
 from src.log import get_logger
 
 log = get_logger("sandbox")
 
+# orjson is optional; both branches produce compact UTF-8 bytes for request
+# bodies, and orjson's decode errors subclass ValueError like the stdlib's.
+try:
+    import orjson
+    _json_dumps = orjson.dumps
+    _json_loads = orjson.loads
+except ImportError:
+    def _json_dumps(obj: Any) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    _json_loads = json.loads
+
+_JSON_HEADERS = {"Content-Type": "application/json"}
+
+# pybase64 is optional: a SIMD drop-in for decoding screenshot payloads.
+try:
+    from pybase64 import b64decode as _b64decode
+except ImportError:
+    _b64decode = base64.b64decode
+
+# Pre-frozen /cmd bodies for the integer-only input commands: %-formatting
+# two ints into bytes is cheaper than serializing a fresh dict per click.
+# Commands carrying strings still go through _json_dumps for escaping.
+_XY_BODY = {
+    cmd: b'{"command":"%s","params":{"x":%%d,"y":%%d}}' % cmd.encode()
+    for cmd in ("left_click", "right_click", "double_click", "move_cursor")
+}
+_DRAG_BODY = b'{"command":"drag_to","params":{"x":%d,"y":%d,"button":%d}}'
+_BUTTON_BODY = {
+    cmd: b'{"command":"%s","params":{"button":%%d}}' % cmd.encode()
+    for cmd in ("mouse_down", "mouse_up")
+}
+_SCROLL_BODY = b'{"command":"scroll","params":{"amount":%d}}'
+
+# Readiness polling: a local API answers in milliseconds once it is up, so
+# probes use a short timeout and retries back off from API_READY_INTERVAL.
+_READY_PROBE_TIMEOUT = 0.5
+_READY_MAX_INTERVAL = 1.0
+
 
 def _safe_getattr(obj, key: str, default):
     return getattr(obj, key, default)
 
 
-def _docker_running(name: str) -> bool:
-    r = subprocess.run(
-        ["docker", "inspect", "-f", "{{.State.Running}}", name],
-        capture_output=True,
-        text=True,
-    )
-    return r.returncode == 0 and r.stdout.strip().lower() == "true"
-
-
-def _docker_exists(name: str) -> bool:
-    r = subprocess.run(
-        ["docker", "inspect", name],
-        capture_output=True,
-        text=True,
-    )
-    return r.returncode == 0
-
-
-
-def _docker_env(name: str) -> Dict[str, str]:
-    """Return container env as dict via docker inspect."""
+def _docker_inspect(name: str) -> Optional[Tuple[bool, Dict[str, str]]]:
+    """
+    (running, env) of a container from a single `docker inspect`, or None if
+    it does not exist. One CLI fork instead of separate running/exists/env
+    probes.
+    """
     r = subprocess.run(
-        ["docker", "inspect", "-f", "{{json .Config.Env}}", name],
+        ["docker", "inspect", "-f", "{{.State.Running}} {{json .Config.Env}}", name],
         capture_output=True,
         text=True,
     )
     if r.returncode != 0:
-        return {}
+        return None
+    running, _, env_json = (r.stdout or "").strip().partition(" ")
+    out: Dict[str, str] = {}
     try:
-        env_list = json.loads((r.stdout or "").strip() or "[]")
-        out: Dict[str, str] = {}
-        for item in env_list:
+        for item in json.loads(env_json or "[]") or []:
             if isinstance(item, str) and "=" in item:
                 k, v = item.split("=", 1)
                 out[k] = v
-        return out
     except Exception:
-        return {}
+        pass
+    return running.lower() == "true", out
 
-def _parse_sse_or_json(text: str) -> Any:
+
+def _event_data_obj(parts: list, nl, ob, cb) -> Any:
+    """
+    JSON object carried by one event's `data:` payloads, or None. Several
+    lines are joined with newlines as SSE specifies; if that is not JSON, the
+    last line that is a complete object on its own wins.
+    """
+    payload = parts[0] if len(parts) == 1 else nl.join(parts)
+    if payload[:1] == ob and payload[-1:] == cb:
+        try:
+            return _json_loads(payload)
+        except Exception:
+            pass
+    if len(parts) > 1:
+        for part in reversed(parts):
+            obj = _event_data_obj([part], nl, ob, cb)
+            if obj is not None:
+                return obj
+    return None
+
+
+def _last_data_obj(text) -> Any:
+    """
+    Last JSON object carried by `data:` lines in `text` (str or bytes), or
+    None. Jumps between `data:` markers with find() and slices payloads by
+    index, so no per-line list is built; the JSON decoder takes bytes directly.
+    Consecutive `data:` lines belong to one event and are parsed together.
+    """
+    if isinstance(text, str):
+        nl, marker, ob, cb = "\n", "data:", "{", "}"
+    else:
+        nl, marker, ob, cb = b"\n", b"data:", b"{", b"}"
+
+    last_obj = None
+    parts: list = []  # payloads of the run of data lines being read
+    prev_end = -1
+    pos = text.find(marker)
+    while pos != -1:
+        end = text.find(nl, pos)
+        if end == -1:
+            end = len(text)
+        # only a marker at the start of a line opens a data field
+        if pos == 0 or text[pos - 1 : pos] == nl:
+            if parts and pos != prev_end + 1:
+                obj = _event_data_obj(parts, nl, ob, cb)
+                if obj is not None:
+                    last_obj = obj
+                parts = []
+            parts.append(text[pos + 5 : end].strip())
+            prev_end = end
+        pos = text.find(marker, end)
+    if parts:
+        obj = _event_data_obj(parts, nl, ob, cb)
+        if obj is not None:
+            last_obj = obj
+    return last_obj
+
+
+def _parse_sse_or_json(text) -> Any:
     """
     The /cmd endpoint sometimes returns JSON, sometimes text/event-stream (SSE).
     - JSON: {"success": true, ...}
     - SSE: data: {...}\n\n (may contain multiple events)
-    Returns the last JSON object found.
+    Returns the last JSON object found. Accepts str or raw bytes.
     """
     text = (text or "").strip()
     if not text:
         raise ValueError("Empty response body")
 
-    # Plain JSON
-    if text.startswith("{") and text.endswith("}"):
-        return json.loads(text)
+    ob, cb = ("{", "}") if isinstance(text, str) else (b"{", b"}")
 
-    last_obj = None
-    for line in text.splitlines():
-        line = line.strip()
-        if not line:
-            continue
-        if line.startswith("data:"):
-            payload = line[len("data:") :].strip()
-            if payload.startswith("{") and payload.endswith("}"):
-                try:
-                    last_obj = json.loads(payload)
-                except Exception:
-                    pass
+    # Plain JSON
+    if text[:1] == ob and text[-1:] == cb:
+        return _json_loads(text)
 
+    last_obj = _last_data_obj(text)
     if last_obj is not None:
         return last_obj
 
     # Fallback: try to extract any JSON substring
-    l = text.find("{")
-    r = text.rfind("}")
+    l = text.find(ob)
+    r = text.rfind(cb)
     if l != -1 and r != -1 and r > l:
-        return json.loads(text[l : r + 1])
+        return _json_loads(text[l : r + 1])
 
     raise ValueError(f"Could not parse response (first 200 chars): {text[:200]!r}")
 
 
+class _SseBuffer:
+    """
+    Carries a partial SSE event across streamed chunks. Only events closed by
+    a blank line are parsed; the unterminated tail stays in `buf`, and the
+    boundary search resumes where the previous one stopped, so no byte is
+    scanned or parsed twice.
+    """
+
+    __slots__ = ("buf", "_scan")
+
+    def __init__(self) -> None:
+        self.buf = bytearray()
+        self._scan = 0
+
+    def feed(self, chunk: bytes) -> Iterator[Any]:
+        self.buf += chunk
+        while True:
+            idx = self.buf.find(b"\n\n", self._scan)
+            if idx == -1:
+                # a boundary may straddle this chunk and the next
+                self._scan = max(0, len(self.buf) - 1)
+                return
+            event = bytes(self.buf[:idx])
+            del self.buf[: idx + 2]
+            self._scan = 0
+            obj = _last_data_obj(event)
+            if obj is not None:
+                yield obj
+
+    def flush(self) -> Optional[Any]:
+        """Parse whatever is left once the stream ends (no trailing blank line, CRLF framing)."""
+        tail = bytes(self.buf)
+        self.buf.clear()
+        self._scan = 0
+        return _last_data_obj(tail)
+
+
+def _read_sse_stream(r: requests.Response) -> Any:
+    """
+    Incremental counterpart of _parse_sse_or_json for a streamed
+    text/event-stream response: complete events are parsed as chunks arrive
+    and only the last JSON `data:` payload is kept, so the body is never
+    buffered whole.
+    """
+    sse = _SseBuffer()
+    last_obj = None
+    for chunk in r.iter_content(chunk_size=8192):
+        for obj in sse.feed(chunk):
+            last_obj = obj
+    tail = sse.flush()
+    if tail is not None:
+        last_obj = tail
+
+    if last_obj is None:
+        raise ValueError("No JSON data event in SSE response")
+    return last_obj
+
+
 class Sandbox:
     """
     Minimal "computer-server" REST wrapper for the trycua/cua-xfce container.
@@ -128,21 +258,36 @@ class Sandbox:
         self.base_url = f"http://{self.api_host}:{self.host_api_port}"
         self.cmd_url = f"{self.base_url}/cmd"
         self.status_url = f"{self.base_url}/status"
+        self.screenshot_url = f"{self.base_url}/screenshot"
 
         self.vnc_resolution = _safe_getattr(cfg, "VNC_RESOLUTION", "1280x720")
         self.vnc_col_depth = int(_safe_getattr(cfg, "VNC_COL_DEPTH", 24))
         self.shm_size = _safe_getattr(cfg, "DOCKER_SHM_SIZE", "512m")
 
-        # screen size cache (avoid spamming /cmd)
+        # screen size, fetched once per container session (VNC_RESOLUTION is
+        # fixed at docker run; start() restarts the container if it changes)
         self._screen_cache: Optional[Tuple[int, int]] = None
-        self._screen_cache_ts: float = 0.0
-        self._screen_cache_ttl: float = float(_safe_getattr(cfg, "SCREEN_CACHE_TTL", 0.5))
+        self._screen_px_max: Optional[Tuple[int, int]] = None  # (w-1, h-1) for _norm_to_px
+
+        # last screenshot payload (raw bytes or base64 str) and its decoded
+        # image (idle screens repeat)
+        self._last_shot_payload: Optional[Any] = None
+        self._last_shot_img: Optional[Image.Image] = None
+        # whether GET /screenshot serves raw image bytes; None = not probed yet
+        self._raw_screenshot_ok: Optional[bool] = None
 
         self.api_ready_timeout = float(_safe_getattr(cfg, "API_READY_TIMEOUT", 180.0))
-        self.api_ready_interval = float(_safe_getattr(cfg, "API_READY_INTERVAL", 1.0))
+        # first retry delay; doubles per attempt up to _READY_MAX_INTERVAL
+        self.api_ready_interval = float(_safe_getattr(cfg, "API_READY_INTERVAL", 0.1))
 
         self.http_timeout = float(_safe_getattr(cfg, "HTTP_TIMEOUT", 30.0))
 
+        # one keep-alive connection pool for every /cmd and /status call
+        self._session = requests.Session()
+        self._session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=8,
+                                                   max_retries=0))
+        self._session.headers["Connection"] = "keep-alive"
+
     # -----------------------
     # Lifecycle
     # -----------------------
@@ -151,20 +296,23 @@ class Sandbox:
         - If the container is already running: just wait for API readiness.
         - If not running: start it with docker run and wait for API readiness.
         """
-        if _docker_running(self.container_name):
-            env = _docker_env(self.container_name)
+        state = _docker_inspect(self.container_name)
+        if state is not None and state[0]:
+            env = state[1]
             want_res = str(self.vnc_resolution)
             want_depth = str(self.vnc_col_depth)
             if env.get("VNC_RESOLUTION") != want_res or env.get("VNC_COL_DEPTH") != want_depth:
                 log.info("VNC env changed -> restarting container")
                 self.stop()
+                state = None
             else:
                 log.info("Container already running: %s", self.container_name)
                 self._wait_api_ready(timeout=self.api_ready_timeout)
+                self._set_screen_cache(None)  # re-read lazily by _norm_to_px
                 return
 
         # Remove stopped container with the same name if it exists (port mapping may have changed)
-        if _docker_exists(self.container_name) and not _docker_running(self.container_name):
+        if state is not None:
             subprocess.run(["docker", "rm", "-f", self.container_name], check=False)
 
         log.info("Starting container...")
@@ -181,9 +329,18 @@ class Sandbox:
         ]
         subprocess.run(cmd, check=True)
         self._wait_api_ready(timeout=self.api_ready_timeout)
+        self._set_screen_cache(None)  # re-read lazily by _norm_to_px
 
     def stop(self) -> None:
         subprocess.run(["docker", "rm", "-f", self.container_name], check=False)
+        self._set_screen_cache(None)
+        self._last_shot_payload = self._last_shot_img = None
+        self._raw_screenshot_ok = None
+        self.close()
+
+    def close(self) -> None:
+        """Drop pooled connections (the session itself stays usable)."""
+        self._session.close()
 
     def launch_vnc_viewer(self) -> None:
         """
@@ -209,11 +366,12 @@ class Sandbox:
         log.info("Waiting up to %ds for API at %s", int(timeout), self.cmd_url)
         t0 = time.time()
         last_err: Optional[Exception] = None
+        delay = self.api_ready_interval
 
         while time.time() - t0 < timeout:
             # 1) /status
             try:
-                r = requests.get(self.status_url, timeout=self.http_timeout)
+                r = self._session.get(self.status_url, timeout=_READY_PROBE_TIMEOUT)
                 if r.status_code == 200:
                     # some versions may return empty body; 200 is sufficient
                     log.info("API ready (/status)")
@@ -223,42 +381,99 @@ class Sandbox:
 
             # 2) /cmd get_screen_size
             try:
-                res = self._post_cmd("get_screen_size", {})
+                res = self._post_cmd("get_screen_size", {}, timeout=_READY_PROBE_TIMEOUT)
                 if isinstance(res, dict) and res.get("success") is True:
                     log.info("API ready (/cmd)")
                     return
             except Exception as e:
                 last_err = e
 
-            time.sleep(self.api_ready_interval)
+            time.sleep(delay)
+            delay = min(delay * 2, _READY_MAX_INTERVAL)
 
         raise TimeoutError(f"Sandbox API did not become ready in time. Last error: {last_err}")
 
     # -----------------------
     # Low-level /cmd
     # -----------------------
-    def _post_cmd(self, command: str, params: Dict[str, Any]) -> Dict[str, Any]:
-        body = {"command": command, "params": params or {}}
-        r = requests.post(self.cmd_url, json=body, timeout=self.http_timeout)
-        parsed = _parse_sse_or_json(r.text)
+    def _post_cmd(self, command: str, params: Dict[str, Any],
+                  timeout: Optional[float] = None) -> Dict[str, Any]:
+        body = _json_dumps({"command": command, "params": params or {}})
+        with self._session.post(self.cmd_url, data=body, headers=_JSON_HEADERS,
+                                timeout=timeout or self.http_timeout, stream=True) as r:
+            ctype = r.headers.get("Content-Type", "")
+            if "application/json" in ctype:
+                parsed = _json_loads(r.content)
+            elif "text/event-stream" in ctype:
+                parsed = _read_sse_stream(r)
+            else:
+                parsed = _parse_sse_or_json(r.content)
         if not isinstance(parsed, dict):
             raise ValueError(f"Unexpected parsed type from /cmd: {type(parsed)}")
         return parsed
 
+    def _post_cmd_nowait(self, command: str, params: Dict[str, Any]) -> None:
+        """
+        /cmd for input actions whose reply ({"success": true}) every caller
+        discards: only the HTTP status is checked and the body is not parsed.
+        The (tiny) body is still read, so the keep-alive connection goes back
+        to the pool instead of being closed.
+        """
+        self._post_body_nowait(_json_dumps({"command": command, "params": params or {}}))
+
+    def _post_body_nowait(self, body: bytes) -> None:
+        r = self._session.post(self.cmd_url, data=body, headers=_JSON_HEADERS,
+                               timeout=self.http_timeout)
+        r.raise_for_status()
+
     # -----------------------
     # Public actions
     # -----------------------
-    def screenshot(self) -> Image.Image:
+    def screenshot_raw(self) -> Optional[bytes]:
         """
-        Expected format: {"success": true, "image_data": "<base64_png>"}
+        Encoded image bytes from GET /screenshot, or None when the server
+        does not serve one (then remembered until the next restart). Skips
+        the base64 inflation and JSON wrapping of the /cmd path.
         """
-        res = self._post_cmd("screenshot", {})
-        if not (isinstance(res, dict) and res.get("success") is True and "image_data" in res):
-            raise ValueError(f"Unexpected screenshot content: {res}")
+        if self._raw_screenshot_ok is False:
+            return None
+        r = self._session.get(self.screenshot_url, timeout=self.http_timeout)
+        if r.status_code == 200 and r.headers.get("Content-Type", "").startswith("image/"):
+            self._raw_screenshot_ok = True
+            return r.content
+        if self._raw_screenshot_ok is None:
+            log.info("GET /screenshot not available (HTTP %d) -> using /cmd screenshot",
+                     r.status_code)
+        self._raw_screenshot_ok = False
+        return None
 
-        raw = base64.b64decode(res["image_data"])
-        img = Image.open(BytesIO(raw)).convert("RGB")
-        return img
+    def screenshot(self) -> Image.Image:
+        """
+        Prefers raw image bytes from GET /screenshot; falls back to /cmd.
+        Expected /cmd format: {"success": true, "image_data": "<base64_png>"}
+        """
+        payload: Any = self.screenshot_raw()
+        if payload is None:
+            res = self._post_cmd("screenshot", {})
+            if not (isinstance(res, dict) and res.get("success") is True and "image_data" in res):
+                raise ValueError(f"Unexpected screenshot content: {res}")
+            payload = res["image_data"]
+
+        # An unchanged screen comes back as the same payload: a compare
+        # (length first, then memcmp) replaces the base64 + PNG decode. Callers
+        # get a copy so they can never mutate the cached frame.
+        if payload == self._last_shot_payload and self._last_shot_img is not None:
+            return self._last_shot_img.copy()
+
+        raw = payload if isinstance(payload, bytes) else _b64decode(payload)
+        img = Image.open(BytesIO(raw))
+        # convert() copies even when the mode already matches; RGB PNGs just decode
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        else:
+            img.load()
+        self._last_shot_payload, self._last_shot_img = payload, img
+        return img.copy()
 
     def get_screen_size(self) -> Tuple[int, int]:
         """
@@ -266,8 +481,7 @@ class Sandbox:
         A) {"success": true, "size": {"width": 1395, "height": 1016}}
         B) {"success": true, "width": 1395, "height": 1016}
         """
-        now = time.time()
-        if self._screen_cache and (now - self._screen_cache_ts) < self._screen_cache_ttl:
+        if self._screen_cache:
             return self._screen_cache
 
         res = self._post_cmd("get_screen_size", {})
@@ -277,71 +491,90 @@ class Sandbox:
         size = res.get("size")
         if isinstance(size, dict) and "width" in size and "height" in size:
             w, h = int(size["width"]), int(size["height"])
-            self._screen_cache = (w, h)
-            self._screen_cache_ts = now
+            self._set_screen_cache((w, h))
             return w, h
 
         if "width" in res and "height" in res:
             w, h = int(res["width"]), int(res["height"])
-            self._screen_cache = (w, h)
-            self._screen_cache_ts = now
+            self._set_screen_cache((w, h))
             return w, h
 
         raise ValueError(f"Invalid screen size shape: {res}")
 
+    def refresh_screen_size(self) -> Tuple[int, int]:
+        """Re-query the screen size (e.g. after an in-VM resolution change)."""
+        self._set_screen_cache(None)
+        return self.get_screen_size()
+
+    def _set_screen_cache(self, size: Optional[Tuple[int, int]]) -> None:
+        self._screen_cache = size
+        self._screen_px_max = None if size is None else (max(0, size[0] - 1), max(0, size[1] - 1))
+
     def _norm_to_px(self, x: float, y: float) -> Tuple[int, int]:
-        w, h = self.get_screen_size()
-        # x/y normalized (0..1). Clamp and map into [0..w-1]/[0..h-1]
-        xn = max(0.0, min(1.0, float(x)))
-        yn = max(0.0, min(1.0, float(y)))
-        px = int(xn * max(0, w - 1))
-        py = int(yn * max(0, h - 1))
-        return px, py
+        px_max = self._screen_px_max
+        if px_max is None:
+            self.get_screen_size()
+            px_max = self._screen_px_max
+        w1, h1 = px_max
+        # Model output may carry ints or numeric strings
+        x = float(x)
+        y = float(y)
+        # x/y normalized (0..1). Clamp inline (no min/max calls) and map into
+        # [0..w-1]/[0..h-1]; `not x >= 0.0` also sends NaN to 0.
+        if not x >= 0.0:
+            x = 0.0
+        elif x > 1.0:
+            x = 1.0
+        if not y >= 0.0:
+            y = 0.0
+        elif y > 1.0:
+            y = 1.0
+        return int(x * w1), int(y * h1)
 
     def left_click_norm(self, x: float, y: float) -> None:
         px, py = self._norm_to_px(x, y)
-        self._post_cmd("left_click", {"x": px, "y": py})
+        self._post_body_nowait(_XY_BODY["left_click"] % (px, py))
 
     def right_click_norm(self, x: float, y: float) -> None:
         px, py = self._norm_to_px(x, y)
-        self._post_cmd("right_click", {"x": px, "y": py})
+        self._post_body_nowait(_XY_BODY["right_click"] % (px, py))
 
     def double_click_norm(self, x: float, y: float) -> None:
         px, py = self._norm_to_px(x, y)
-        self._post_cmd("double_click", {"x": px, "y": py})
+        self._post_body_nowait(_XY_BODY["double_click"] % (px, py))
 
     def type_text(self, text: str) -> None:
-        self._post_cmd("type_text", {"text": str(text)})
+        self._post_cmd_nowait("type_text", {"text": str(text)})
 
     def press_key(self, key: str) -> None:
-        self._post_cmd("press_key", {"key": str(key)})
+        self._post_cmd_nowait("press_key", {"key": str(key)})
 
     def hotkey(self, keys) -> None:
-        self._post_cmd("hotkey", {"keys": list(keys)})
+        self._post_cmd_nowait("hotkey", {"keys": list(keys)})
 
     def scroll(self, amount: int) -> None:
-        self._post_cmd("scroll", {"amount": int(amount)})
+        self._post_body_nowait(_SCROLL_BODY % int(amount))
 
     # --- Manual control helpers (GUI) ---
     def mouse_move_norm(self, x: float, y: float) -> None:
         px, py = self._norm_to_px(x, y)
-        self._post_cmd("move_cursor", {"x": px, "y": py})
+        self._post_body_nowait(_XY_BODY["move_cursor"] % (px, py))
 
     def mouse_down(self, button: int = 1) -> None:
-        self._post_cmd("mouse_down", {"button": int(button)})
+        self._post_body_nowait(_BUTTON_BODY["mouse_down"] % int(button))
 
     def mouse_up(self, button: int = 1) -> None:
-        self._post_cmd("mouse_up", {"button": int(button)})
+        self._post_body_nowait(_BUTTON_BODY["mouse_up"] % int(button))
 
     def drag_to_norm(self, x: float, y: float, button: int = 1) -> None:
         px, py = self._norm_to_px(x, y)
-        self._post_cmd("drag_to", {"x": px, "y": py, "button": int(button)})
+        self._post_body_nowait(_DRAG_BODY % (px, py, int(button)))
 
     def key_down(self, key: str) -> None:
-        self._post_cmd("key_down", {"key": str(key)})
+        self._post_cmd_nowait("key_down", {"key": str(key)})
 
     def key_up(self, key: str) -> None:
-        self._post_cmd("key_up", {"key": str(key)})
+        self._post_cmd_nowait("key_up", {"key": str(key)})
 
     def wait(self, seconds: float) -> None:
         time.sleep(float(seconds))
@@ -2,8 +2,13 @@
 from __future__ import annotations
 
 import base64
+import functools
 import os
-from typing import TYPE_CHECKING
+import struct
+import weakref
+from concurrent.futures import Future, ThreadPoolExecutor
+from io import BytesIO
+from typing import TYPE_CHECKING, Optional, Tuple
 
 import numpy as np
 from PIL import Image, ImageDraw
@@ -16,38 +21,166 @@ log = get_logger("vision")
 if TYPE_CHECKING:
     from src.sandbox import Sandbox
 
+# pybase64 is optional: a SIMD drop-in for base64.b64encode, which is the
+# main CPU cost of turning a screenshot into a data URI.
+try:
+    from pybase64 import b64encode as _b64encode
+except ImportError:
+    _b64encode = base64.b64encode
 
-def image_to_data_uri(path: str) -> str:
-    ext = os.path.splitext(path)[1].lower()
-    mime = IMAGE_MIME.get(ext, "application/octet-stream")
+
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def _file_key(path: str) -> Tuple[str, int, int]:
+    """Cache key that changes whenever the file is rewritten."""
+    st = os.stat(path)
+    return path, st.st_mtime_ns, st.st_size
+
+
+def image_bytes_to_data_uri(raw: bytes, mime: str = "image/png") -> str:
+    return f"data:{mime};base64,{_b64encode(raw).decode('ascii')}"
+
+
+def _bytes_image_size(raw: bytes) -> Tuple[int, int]:
+    # PNG: IHDR is always the first chunk, width/height sit at bytes 16..24
+    if raw[:8] == _PNG_SIGNATURE and raw[12:16] == b"IHDR":
+        return struct.unpack(">II", raw[16:24])
+    with Image.open(BytesIO(raw)) as img:
+        return img.size
+
+
+@functools.lru_cache(maxsize=2)
+def _read_file_cached(path: str, mtime_ns: int, size: int) -> bytes:
     with open(path, "rb") as f:
-        b64 = base64.b64encode(f.read()).decode("utf-8")
-    return f"data:{mime};base64,{b64}"
-
-
-def resize_keep_aspect(img: Image.Image, max_dim: int) -> Image.Image:
-    w, h = img.size
-    if w <= max_dim and h <= max_dim:
-        return img
-    if w >= h:
-        new_w = max_dim
-        new_h = int(h * max_dim / w)
-    else:
-        new_h = max_dim
-        new_w = int(w * max_dim / h)
-    return img.resize((new_w, new_h), Image.Resampling.LANCZOS)
+        return f.read()
+
+
+# The caches below are keyed on the image bytes themselves (bytes hash once,
+# then memcmp on a hit). A screen that did not change is re-captured with a
+# new mtime but identical bytes, so it skips the encode/resize work and yields
+# the same URI — which also lets llama-cpp-python's vision handler reuse the
+# image embedding it computed for the previous step.
+
+@functools.lru_cache(maxsize=4)
+def _payload_from_bytes(raw: bytes, mime: str) -> Tuple[str, int, int]:
+    w, h = _bytes_image_size(raw)
+    return image_bytes_to_data_uri(raw, mime), w, h
+
+
+def _payload_for_key(key: Tuple[str, int, int]) -> Tuple[str, int, int]:
+    mime = IMAGE_MIME.get(os.path.splitext(key[0])[1].lower(), "application/octet-stream")
+    return _payload_from_bytes(_read_file_cached(*key), mime)
+
+
+# One background worker encodes the screenshot right after capture_screen
+# writes it, overlapping with screen_changed() and history bookkeeping.
+_prefetch_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="screenshot-encode")
+_prefetched: Optional[Tuple[Tuple[str, int, int], Future]] = None
+
+
+def prefetch_image_payload(path: str) -> None:
+    """Start computing image_payload(path) in the background."""
+    global _prefetched
+    key = _file_key(path)
+    _prefetched = (key, _prefetch_pool.submit(_payload_for_key, key))
+
+
+def image_payload(path: str) -> Tuple[str, int, int]:
+    """(data_uri, width, height) for an image file, read from disk once.
+
+    The read is memoized on (path, mtime, size) and the encode on the bytes,
+    so retries on an unchanged screen skip the base64 encode entirely.
+    """
+    key = _file_key(path)
+    pending = _prefetched
+    if pending is not None and pending[0] == key:
+        return pending[1].result()
+    return _payload_for_key(key)
+
+
+def image_to_data_uri(path: str) -> str:
+    """Base64 data URI for an image file (see image_payload)."""
+    return image_payload(path)[0]
+
+
+def image_size(path: str) -> Tuple[int, int]:
+    """Return (width, height) of an image file (see image_payload)."""
+    _, w, h = image_payload(path)
+    return w, h
+
+
+# JPEG quality for screenshots re-encoded at the model's input size
+_LLM_JPEG_QUALITY = 85
+
+
+@functools.lru_cache(maxsize=4)
+def _resized_data_uri_cached(raw: bytes, width: int, height: int) -> str:
+    with Image.open(BytesIO(raw)) as img:
+        small = img.convert("RGB").resize((width, height), Image.Resampling.BILINEAR)
+    buf = BytesIO()
+    small.save(buf, "JPEG", quality=_LLM_JPEG_QUALITY)
+    return image_bytes_to_data_uri(buf.getvalue(), "image/jpeg")
+
+
+def resized_image_data_uri(path: str, width: int, height: int) -> str:
+    """JPEG data URI of the image resized to exactly (width, height).
+
+    Used to hand the vision encoder a screenshot already at its internal
+    resolution, instead of a full-size PNG it would downscale itself.
+    """
+    return _resized_data_uri_cached(_read_file_cached(*_file_key(path)), width, height)
+
+
+def resize_keep_aspect(img: Image.Image, max_dim: int,
+                       resample: Optional[Image.Resampling] = None) -> Image.Image:
+    """Shrink `img` in place to fit max_dim x max_dim and return it.
+
+    Image.thumbnail does the aspect math in C and never upscales. BOX (the
+    default) is plenty for the LLM path: every model client resizes again for its own
+    vision encoder.
+    """
+    img.thumbnail((max_dim, max_dim),
+                  Image.Resampling.BOX if resample is None else resample)
+    return img
+
+
+def _as_rgb(img: Image.Image) -> Image.Image:
+    """Sandbox.screenshot already returns RGB; convert() would still copy it."""
+    return img if img.mode == "RGB" else img.convert("RGB")
 
 def capture_screen(sandbox, save_path: str) -> Image.Image:
     """Capture screenshot for LLM: resized to MAX_DIM and saved to disk."""
-    img = sandbox.screenshot().convert("RGB")
-    img = resize_keep_aspect(img, cfg.MAX_DIM)
+    # screenshot() hands back a fresh image, so it can be shrunk in place
+    img = resize_keep_aspect(_as_rgb(sandbox.screenshot()), cfg.MAX_DIM)
     img.save(save_path)
+    prefetch_image_payload(save_path)
     return img
 
 
 def capture_screen_raw(sandbox) -> Image.Image:
     """For the GUI: return raw image without touching resolution."""
-    return sandbox.screenshot().convert("RGB")
+    return _as_rgb(sandbox.screenshot())
+
+
+# screen_changed compares thumbnails of this size; the int16 difference is
+# written into one reused scratch array instead of three float32 temporaries.
+_DIFF_SIZE = (160, 90)
+_diff_scratch = np.empty((_DIFF_SIZE[1], _DIFF_SIZE[0], 3), dtype=np.int16)
+
+# Thumbnail of the last `curr` seen. The agent loops pass each step's
+# screenshot back as the next call's `prev`, so one slot saves a resize.
+_last_thumb: Optional[Tuple["weakref.ref[Image.Image]", np.ndarray]] = None
+
+
+def _diff_thumb(img: Image.Image) -> np.ndarray:
+    global _last_thumb
+    cached = _last_thumb
+    if cached is not None and cached[0]() is img:
+        return cached[1]
+    thumb = np.asarray(img.resize(_DIFF_SIZE, Image.Resampling.BILINEAR))
+    _last_thumb = (weakref.ref(img), thumb)
+    return thumb
 
 
 def screen_changed(prev: Image.Image, curr: Image.Image,
@@ -60,9 +193,11 @@ def screen_changed(prev: Image.Image, curr: Image.Image,
     if threshold <= 0.0:
         threshold = cfg.CHANGE_THRESHOLD
     try:
-        a = np.asarray(prev.resize((160, 90))).astype(np.float32)
-        b = np.asarray(curr.resize((160, 90))).astype(np.float32)
-        diff = np.mean(np.abs(a - b)) / 255.0
+        a = _diff_thumb(prev)
+        b = _diff_thumb(curr)
+        scratch = _diff_scratch if a.shape == _diff_scratch.shape else np.empty(a.shape, np.int16)
+        np.subtract(a, b, out=scratch, dtype=np.int16)
+        diff = float(np.abs(scratch, out=scratch).mean()) / 255.0
         changed = bool(diff > threshold)
         log.debug("screen_changed: diff=%.4f threshold=%.4f -> %s", diff, threshold, changed)
         return changed
@@ -72,7 +207,13 @@ def screen_changed(prev: Image.Image, curr: Image.Image,
 
 
 def draw_preview(img: Image.Image, x: float, y: float, out_path: str, r: int = 10) -> None:
-    cp = img.copy().convert("RGB")
+    """Save `img` with a red dot at normalized (x, y); `img` is left unchanged.
+
+    The dot is drawn on a private copy: the GUI keeps displaying `img`, so it
+    must never be drawn on, even briefly.
+    """
+    # convert() already returns a new image; only RGB input needs a copy
+    cp = img.copy() if img.mode == "RGB" else img.convert("RGB")
     w, h = cp.size
     px = int(max(0.0, min(1.0, x)) * max(0, w - 1))
     py = int(max(0.0, min(1.0, y)) * max(0, h - 1))
@@ -0,0 +1,35 @@
+"""Shared test setup.
+
+Makes the repository root importable (``src.*``) however pytest is invoked,
+and installs stand-ins for modules the src imports need but CI lacks.
+"""
+import os
+import sys
+import types
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Stand-in modules installed before any src imports: llama_cpp (CUDA DLLs are
+# unavailable here), huggingface_hub, and PIL (for image_to_data_uri and vision.py).
+# Parents come before their submodules so each submodule is also set as an
+# attribute of its parent, like a real import.
+_MOCKS = (
+    ("llama_cpp", {"Llama": type("Llama", (), {})}),
+    ("llama_cpp.llama_chat_format", {
+        "Qwen25VLChatHandler": type("Qwen25VLChatHandler", (), {"__init__": lambda self, **kw: None}),
+        "Qwen3VLChatHandler": type("Qwen3VLChatHandler", (), {"__init__": lambda self, **kw: None}),
+    }),
+    ("huggingface_hub", {"hf_hub_download": lambda **kw: "/mock/path"}),
+    ("PIL", {}),
+    ("PIL.Image", {"open": lambda *a, **kw: None, "Image": type("Image", (), {})}),
+    ("PIL.ImageDraw", {
+        "Draw": lambda *a, **kw: type("MockDraw", (), {"ellipse": lambda *a, **kw: None})(),
+    }),
+)
+for _name, _attrs in _MOCKS:
+    _mod = types.ModuleType(_name)
+    _mod.__dict__.update(_attrs)
+    sys.modules[_name] = _mod
+    _parent, _, _child = _name.rpartition(".")
+    if _parent:
+        setattr(sys.modules[_parent], _child, _mod)
@@ -1,31 +1,12 @@
-"""Tests for execute_action — especially Fara compound actions and enhanced TYPE."""
-import sys
-import os
-import types
+"""Tests for execute_action — especially Fara compound actions and enhanced TYPE —
+and for parsing UI-TARS replies into those actions."""
 import time
 
-# Mock llama_cpp (needed by config -> llm_client chain)
-mock_llama = types.ModuleType("llama_cpp")
-mock_llama.Llama = type("Llama", (), {})
-sys.modules["llama_cpp"] = mock_llama
-mock_chat_format = types.ModuleType("llama_cpp.llama_chat_format")
-sys.modules["llama_cpp.llama_chat_format"] = mock_chat_format
-mock_hf = types.ModuleType("huggingface_hub")
-mock_hf.hf_hub_download = lambda **kw: "/mock/path"
-sys.modules["huggingface_hub"] = mock_hf
-mock_pil = types.ModuleType("PIL")
-mock_pil_image = types.ModuleType("PIL.Image")
-mock_pil_image.Image = type("Image", (), {})  # PIL.Image.Image class
-mock_pil_image.open = lambda *a, **kw: None
-mock_pil_imagedraw = types.ModuleType("PIL.ImageDraw")
-mock_pil_imagedraw.Draw = lambda *a, **kw: type("MockDraw", (), {"ellipse": lambda *a, **kw: None})()
-mock_pil.Image = mock_pil_image
-mock_pil.ImageDraw = mock_pil_imagedraw
-sys.modules["PIL"] = mock_pil
-sys.modules["PIL.Image"] = mock_pil_image
-sys.modules["PIL.ImageDraw"] = mock_pil_imagedraw
-
-sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pytest
+
+from src.actions import execute_action
+from src.llm_client import _parse_uitars_output, _smart_resize
+
 
 # Mock Sandbox
 class MockSandbox:
@@ -67,187 +48,129 @@ class MockSandbox:
         self.calls.append(("drag_to_norm", x, y, button))
 
 
-# Patch time.sleep to avoid actual delays
-original_sleep = time.sleep
-time.sleep = lambda secs: None
-
-from src.actions import execute_action
-
-passed = 0
-failed = 0
-
-def check(name, got, expected):
-    global passed, failed
-    if got == expected:
-        passed += 1
-        print(f"  PASS: {name}")
-    else:
-        failed += 1
-        print(f"  FAIL: {name}")
-        print(f"    expected: {expected}")
-        print(f"    got:      {got}")
-
-
-# ═══════════════════════════════════════════
-# 1. VISIT_URL compound action
-# ═══════════════════════════════════════════
-print("\n=== VISIT_URL ===")
-sb = MockSandbox()
-execute_action(sb, {"action": "VISIT_URL", "url": "https://huggingface.co/models"})
-# Should: hotkey ctrl+l, hotkey ctrl+a, type_text url, press enter
-check("call count", len(sb.calls), 4)
-check("1st: ctrl+l", sb.calls[0], ("hotkey", ("ctrl", "l")))
-check("2nd: ctrl+a", sb.calls[1], ("hotkey", ("ctrl", "a")))
-check("3rd: type url", sb.calls[2], ("type_text", "https://huggingface.co/models"))
-check("4th: enter", sb.calls[3], ("press_key", "enter"))
-
-
-# ═══════════════════════════════════════════
-# 2. WEB_SEARCH compound action
-# ═══════════════════════════════════════════
-print("\n=== WEB_SEARCH ===")
-sb = MockSandbox()
-execute_action(sb, {"action": "WEB_SEARCH", "query": "best 7B models"})
-check("call count", len(sb.calls), 4)
-check("1st: ctrl+l", sb.calls[0], ("hotkey", ("ctrl", "l")))
-check("2nd: ctrl+a", sb.calls[1], ("hotkey", ("ctrl", "a")))
-check("3rd: type query", sb.calls[2], ("type_text", "best 7B models"))
-check("4th: enter", sb.calls[3], ("press_key", "enter"))
-
-
-# ═══════════════════════════════════════════
-# 3. TYPE with click coordinates (Fara feature)
-# ═══════════════════════════════════════════
-print("\n=== TYPE with click_x/click_y ===")
-sb = MockSandbox()
-execute_action(sb, {"action": "TYPE", "text": "hello", "click_x": 0.3, "click_y": 0.5})
-check("has click first", sb.calls[0], ("left_click_norm", 0.3, 0.5))
-check("then type", sb.calls[1], ("type_text", "hello"))
-
-
-# ═══════════════════════════════════════════
-# 4. TYPE with delete_existing
-# ═══════════════════════════════════════════
-print("\n=== TYPE with delete_existing ===")
-sb = MockSandbox()
-execute_action(sb, {"action": "TYPE", "text": "new text", "delete_existing": True})
-check("ctrl+a to select all", sb.calls[0], ("hotkey", ("ctrl", "a")))
-check("then type", sb.calls[1], ("type_text", "new text"))
-
-
-# ═══════════════════════════════════════════
-# 5. TYPE with press_enter
-# ═══════════════════════════════════════════
-print("\n=== TYPE with press_enter ===")
-sb = MockSandbox()
-execute_action(sb, {"action": "TYPE", "text": "query", "press_enter": True})
-check("type text", sb.calls[0], ("type_text", "query"))
-check("then enter", sb.calls[1], ("press_key", "enter"))
-
-
-# ═══════════════════════════════════════════
-# 6. TYPE with all options
-# ═══════════════════════════════════════════
-print("\n=== TYPE with all options ===")
-sb = MockSandbox()
-execute_action(sb, {
-    "action": "TYPE", "text": "full test",
-    "click_x": 0.2, "click_y": 0.8,
-    "delete_existing": True, "press_enter": True
-})
-check("1st: click field", sb.calls[0], ("left_click_norm", 0.2, 0.8))
-check("2nd: ctrl+a", sb.calls[1], ("hotkey", ("ctrl", "a")))
-check("3rd: type", sb.calls[2], ("type_text", "full test"))
-check("4th: enter", sb.calls[3], ("press_key", "enter"))
-
-
-# ═══════════════════════════════════════════
-# 7. TYPE without press_enter (explicit false)
-# ═══════════════════════════════════════════
-print("\n=== TYPE without press_enter ===")
-sb = MockSandbox()
-execute_action(sb, {"action": "TYPE", "text": "no enter", "press_enter": False})
-check("just type, no enter", len(sb.calls), 1)
-check("type text", sb.calls[0], ("type_text", "no enter"))
-
-
-# ═══════════════════════════════════════════
-# 8. Standard CLICK (unchanged)
-# ═══════════════════════════════════════════
-print("\n=== Standard CLICK ===")
-sb = MockSandbox()
-execute_action(sb, {"action": "CLICK", "x": 0.5, "y": 0.5})
-check("click", sb.calls[0], ("left_click_norm", 0.5, 0.5))
-
-
-# ═══════════════════════════════════════════
-# 9. MOVE
-# ═══════════════════════════════════════════
-print("\n=== MOVE ===")
-sb = MockSandbox()
-execute_action(sb, {"action": "MOVE", "x": 0.3, "y": 0.7})
-check("move", sb.calls[0], ("mouse_move_norm", 0.3, 0.7))
-
-
-# ═══════════════════════════════════════════
-# 10. BITTI (no-op)
-# ═══════════════════════════════════════════
-print("\n=== BITTI ===")
-sb = MockSandbox()
-execute_action(sb, {"action": "BITTI"})
-check("bitti no calls", len(sb.calls), 0)
-
-
-# ═══════════════════════════════════════════
-# 11. NOOP
-# ═══════════════════════════════════════════
-print("\n=== NOOP ===")
-sb = MockSandbox()
-execute_action(sb, {"action": "NOOP"})
-check("noop no calls", len(sb.calls), 0)
-
-
-# ═══════════════════════════════════════════
-# 12. HOTKEY
-# ═══════════════════════════════════════════
-print("\n=== HOTKEY ===")
-sb = MockSandbox()
-execute_action(sb, {"action": "HOTKEY", "keys": ["alt", "left"]})
-check("hotkey", sb.calls[0], ("hotkey", ("alt", "left")))
-
-
-# ═══════════════════════════════════════════
-# 13. SCROLL
-# ═══════════════════════════════════════════
-print("\n=== SCROLL ===")
-sb = MockSandbox()
-execute_action(sb, {"action": "SCROLL", "scroll": -3})
-check("scroll", sb.calls[0], ("scroll", -3))
-
-
-# ═══════════════════════════════════════════
-# 14. Unknown action raises
-# ═══════════════════════════════════════════
-print("\n=== Unknown action ===")
-sb = MockSandbox()
-try:
-    execute_action(sb, {"action": "UNKNOWN_ACTION_XYZ"})
-    check("should have raised", False, True)
-except ValueError as e:
-    check("raises ValueError", "Unknown action" in str(e), True)
-
-
-# Restore time.sleep
-time.sleep = original_sleep
-
-# ═══════════════════════════════════════════
-# Summary
-# ═══════════════════════════════════════════
-print(f"\n{'='*50}")
-print(f"Results: {passed} passed, {failed} failed")
-if failed > 0:
-    print("SOME TESTS FAILED!")
-    sys.exit(1)
-else:
-    print("ALL TESTS PASSED!")
-    sys.exit(0)
+@pytest.fixture(autouse=True)
+def no_sleep(monkeypatch):
+    """Skip the real pauses between actions (restored after each test)."""
+    monkeypatch.setattr(time, "sleep", lambda secs: None)
+
+
+@pytest.fixture
+def sb():
+    return MockSandbox()
+
+
+# Address-bar prefix shared by the Fara compound actions: focus, select all
+_ADDRESS_BAR = [("hotkey", ("ctrl", "l")), ("hotkey", ("ctrl", "a"))]
+
+
+@pytest.mark.parametrize("act, expected_calls", [
+    # Compound actions (Fara-7B native)
+    pytest.param(
+        {"action": "VISIT_URL", "url": "https://huggingface.co/models"},
+        _ADDRESS_BAR + [("type_text", "https://huggingface.co/models"), ("press_key", "enter")],
+        id="visit_url",
+    ),
+    pytest.param(
+        {"action": "WEB_SEARCH", "query": "best 7B models"},
+        _ADDRESS_BAR + [("type_text", "best 7B models"), ("press_key", "enter")],
+        id="web_search",
+    ),
+    # Enhanced TYPE
+    pytest.param(
+        {"action": "TYPE", "text": "hello", "click_x": 0.3, "click_y": 0.5},
+        [("left_click_norm", 0.3, 0.5), ("type_text", "hello")],
+        id="type_click_first",
+    ),
+    pytest.param(
+        {"action": "TYPE", "text": "new text", "delete_existing": True},
+        [("hotkey", ("ctrl", "a")), ("type_text", "new text")],
+        id="type_delete_existing",
+    ),
+    pytest.param(
+        {"action": "TYPE", "text": "query", "press_enter": True},
+        [("type_text", "query"), ("press_key", "enter")],
+        id="type_press_enter",
+    ),
+    pytest.param(
+        {"action": "TYPE", "text": "full test", "click_x": 0.2, "click_y": 0.8,
+         "delete_existing": True, "press_enter": True},
+        [("left_click_norm", 0.2, 0.8), ("hotkey", ("ctrl", "a")),
+         ("type_text", "full test"), ("press_key", "enter")],
+        id="type_all_options",
+    ),
+    pytest.param(
+        {"action": "TYPE", "text": "no enter", "press_enter": False},
+        [("type_text", "no enter")],
+        id="type_no_enter",
+    ),
+    # Standard actions
+    pytest.param({"action": "CLICK", "x": 0.5, "y": 0.5},
+                 [("left_click_norm", 0.5, 0.5)], id="click"),
+    pytest.param({"action": "MOVE", "x": 0.3, "y": 0.7},
+                 [("mouse_move_norm", 0.3, 0.7)], id="move"),
+    pytest.param({"action": "HOTKEY", "keys": ["alt", "left"]},
+                 [("hotkey", ("alt", "left"))], id="hotkey"),
+    pytest.param({"action": "SCROLL", "scroll": -3},
+                 [("scroll", -3)], id="scroll"),
+    # No-ops
+    pytest.param({"action": "BITTI"}, [], id="bitti"),
+    pytest.param({"action": "NOOP"}, [], id="noop"),
+])
+def test_execute_action(sb, act, expected_calls):
+    execute_action(sb, act)
+    assert sb.calls == expected_calls
+
+
+def test_unknown_action_raises(sb):
+    with pytest.raises(ValueError, match="Unknown action"):
+        execute_action(sb, {"action": "UNKNOWN_ACTION_XYZ"})
+
+
+# UI-TARS coordinates are in smart_resize space of the screenshot
+_IMG_W, _IMG_H = 1920, 1080
+_SMART_H, _SMART_W = _smart_resize(_IMG_H, _IMG_W)
+
+
+@pytest.mark.parametrize("text, expected", [
+    pytest.param("Thought: Click the search box.\nAction: click(start_box='(235,512)')",
+                 {"action": "CLICK", "x": 235 / _SMART_W, "y": 512 / _SMART_H,
+                  "target": "Click the search box.", "why_short": "Click the search box."},
+                 id="click"),
+    pytest.param("Action: left_double(start_box='(10,20)')",
+                 {"action": "DOUBLE_CLICK", "x": 10 / _SMART_W, "y": 20 / _SMART_H,
+                  "target": "", "why_short": ""},
+                 id="double_click"),
+    pytest.param("Action: right_single(start_box='(10, 20)')",
+                 {"action": "RIGHT_CLICK", "x": 10 / _SMART_W, "y": 20 / _SMART_H,
+                  "target": "", "why_short": ""},
+                 id="right_click_spaced_coords"),
+    # drag is offered in the prompt but has no executor; it must not misfire as a click
+    pytest.param("Thought: drag\nAction: drag(start_box='(1,2)', end_box='(3,4)')",
+                 {"action": "NOOP",
+                  "why_short": "Unknown UI-TARS action: drag(start_box='(1,2)', end_box='(3,4)')"},
+                 id="drag"),
+    # Nested parentheses and an escaped newline inside the argument
+    pytest.param("Thought: type\nAction: type(content='f(x) = (a, b)\\n')",
+                 {"action": "TYPE", "text": "f(x) = (a, b)\n", "target": "type", "why_short": "type"},
+                 id="type_nested_parens"),
+    pytest.param("Action: hotkey(key='ctrl l')",
+                 {"action": "HOTKEY", "keys": ["ctrl", "l"], "target": "", "why_short": ""},
+                 id="hotkey_combo"),
+    pytest.param("Action: hotkey(key='enter')",
+                 {"action": "PRESS", "key": "enter", "target": "", "why_short": ""},
+                 id="hotkey_single"),
+    pytest.param("Action: scroll(start_box='(5,5)', direction='down')",
+                 {"action": "SCROLL", "scroll": -3, "target": "", "why_short": ""},
+                 id="scroll_down"),
+    pytest.param("Action: scroll(direction='up')",
+                 {"action": "SCROLL", "scroll": 3, "target": "", "why_short": ""},
+                 id="scroll_up"),
+    pytest.param("Thought: done\nAction: finished(content='ok')",
+                 {"action": "BITTI", "target": "done", "why_short": "done"},
+                 id="finished"),
+    pytest.param("no action here",
+                 {"action": "NOOP", "why_short": "Could not parse: no action here"},
+                 id="unparseable"),
+])
+def test_parse_uitars_output(text, expected):
+    assert _parse_uitars_output(text, _IMG_W, _IMG_H) == pytest.approx(expected)
@@ -0,0 +1,118 @@
+"""Tests for the Sandbox REST client — /cmd response parsing and request bodies."""
+import json
+import types
+
+import pytest
+
+from src.sandbox import Sandbox, _SseBuffer, _parse_sse_or_json, _read_sse_stream
+
+
+def _fake_response(chunks):
+    return types.SimpleNamespace(iter_content=lambda chunk_size: iter(chunks))
+
+
+def _feed_all(chunks):
+    """Objects _SseBuffer yields while fed chunks, then whatever flush() finds."""
+    sse = _SseBuffer()
+    objs = [obj for chunk in chunks for obj in sse.feed(chunk)]
+    return objs, sse.flush()
+
+
+# ═══════════════════════════════════════════
+# SSE / JSON response parsing
+# ═══════════════════════════════════════════
+@pytest.mark.parametrize("chunks, objs, tail", [
+    pytest.param([b'data: {"a": 1}\n\ndata: {"b": 2}\n\n'],
+                 [{"a": 1}, {"b": 2}], None, id="two_events_one_chunk"),
+    pytest.param([b'data: {"succ', b'ess": true}\n', b'\ndata: {"n": 2}\n\n'],
+                 [{"success": True}, {"n": 2}], None, id="event_split_across_chunks"),
+    pytest.param([b'event: result\ndata: {"a":', b' 1,\ndata:  "b": 2}\n\n'],
+                 [{"a": 1, "b": 2}], None, id="object_over_several_data_lines"),
+    pytest.param([b'data: {"a": 1}\n\n', b'data: {"done": true}'],
+                 [{"a": 1}], {"done": True}, id="trailing_event_without_blank_line"),
+    pytest.param([b'data: {"a": 1}\r\n\r\n'],
+                 [], {"a": 1}, id="crlf_framing"),
+    pytest.param([b": keep-alive\n\n", b"data: not json\n\n"],
+                 [], None, id="no_json_payload"),
+])
+def test_sse_buffer(chunks, objs, tail):
+    assert _feed_all(chunks) == (objs, tail)
+
+
+def test_read_sse_stream_keeps_last_object():
+    r = _fake_response([b'data: {"a": 1}\n', b'\ndata: {"success": true', b', "out": "x"}'])
+    assert _read_sse_stream(r) == {"success": True, "out": "x"}
+
+
+def test_read_sse_stream_without_json_raises():
+    with pytest.raises(ValueError, match="No JSON data event"):
+        _read_sse_stream(_fake_response([b": ping\n\n"]))
+
+
+@pytest.mark.parametrize("body, expected", [
+    pytest.param(b'{"success": true, "x": 1}', {"success": True, "x": 1}, id="plain_json_bytes"),
+    pytest.param(' {"success": true}\n', {"success": True}, id="plain_json_str"),
+    pytest.param(b'data: {"a": 1}\n\ndata: {"b": 2}\n\n', {"b": 2}, id="sse_last_event"),
+    pytest.param(b'data: {"a":\ndata: 2}\n\n', {"a": 2}, id="sse_multiline_data"),
+])
+def test_parse_sse_or_json(body, expected):
+    assert _parse_sse_or_json(body) == expected
+
+
+def test_parse_sse_or_json_empty_raises():
+    with pytest.raises(ValueError, match="Empty response body"):
+        _parse_sse_or_json(b"  ")
+
+
+# ═══════════════════════════════════════════
+# Coordinate mapping
+# ═══════════════════════════════════════════
+@pytest.fixture
+def sized_sandbox():
+    """Sandbox with a cached 1920x1080 screen and no container behind it."""
+    sb = Sandbox.__new__(Sandbox)
+    sb._set_screen_cache((1920, 1080))
+    return sb
+
+
+@pytest.mark.parametrize("x, y, expected", [
+    pytest.param(0.5, 0.5, (959, 539), id="center"),
+    pytest.param("0.5", "0.25", (959, 269), id="numeric_strings"),
+    pytest.param(1, 0, (1919, 0), id="ints"),
+    pytest.param(-0.2, 1.7, (0, 1079), id="clamped"),
+    pytest.param(float("nan"), 0.5, (0, 539), id="nan"),
+])
+def test_norm_to_px(sized_sandbox, x, y, expected):
+    assert sized_sandbox._norm_to_px(x, y) == expected
+
+
+# ═══════════════════════════════════════════
+# Pre-built /cmd bodies
+# ═══════════════════════════════════════════
+@pytest.mark.parametrize("method, args, expected", [
+    pytest.param("left_click_norm", (0.5, 0.25),
+                 {"command": "left_click", "params": {"x": 959, "y": 269}}, id="left_click"),
+    pytest.param("right_click_norm", (0.5, 0.25),
+                 {"command": "right_click", "params": {"x": 959, "y": 269}}, id="right_click"),
+    pytest.param("double_click_norm", (0.5, 0.25),
+                 {"command": "double_click", "params": {"x": 959, "y": 269}}, id="double_click"),
+    pytest.param("mouse_move_norm", (0.0, 1.0),
+                 {"command": "move_cursor", "params": {"x": 0, "y": 1079}}, id="move_cursor"),
+    pytest.param("drag_to_norm", (1.0, 0.5, 3),
+                 {"command": "drag_to", "params": {"x": 1919, "y": 539, "button": 3}}, id="drag_to"),
+    pytest.param("mouse_down", (1,),
+                 {"command": "mouse_down", "params": {"button": 1}}, id="mouse_down"),
+    pytest.param("mouse_up", (2,),
+                 {"command": "mouse_up", "params": {"button": 2}}, id="mouse_up"),
+    pytest.param("scroll", (-3,),
+                 {"command": "scroll", "params": {"amount": -3}}, id="scroll_down"),
+    pytest.param("scroll", (5,),
+                 {"command": "scroll", "params": {"amount": 5}}, id="scroll_up"),
+])
+def test_cmd_body_templates(sized_sandbox, method, args, expected):
+    # Each body must decode to the dict these methods used to json.dumps
+    sent = []
+    sized_sandbox._post_body_nowait = sent.append
+    getattr(sized_sandbox, method)(*args)
+    assert len(sent) == 1
+    assert json.loads(sent[0]) == expected